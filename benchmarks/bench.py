@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# coding: utf-8
+# Serialization time, peak memory and emitted bytes of set_df and the chart
+# functions on synthetic frames. IPython.display is mocked, so this runs
+# without a notebook:
+#
+#   python benchmarks/bench.py --sizes 10000 100000 --out before.json
+#   python benchmarks/bench.py --sizes 10000 100000 --compare before.json
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import contextlib
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+import pydcjs
+from pydcjs import main
+
+SIZES=[10000,100000,1000000,10000000]
+
+def frame(n,seed=0):
+	rng=np.random.RandomState(seed)
+	return pd.DataFrame({
+		'x':rng.normal(size=n),
+		'y':rng.normal(size=n),
+		'v':rng.rand(n)*100,
+		'i':rng.randint(0,50,n),
+		'j':rng.randint(0,20,n),
+		'cat':pd.Categorical(rng.choice(['a','b','c','d','e'],n)),
+		'name':rng.choice(['alpha','beta','gamma','delta'],n).astype(object),
+		't':pd.Timestamp('2020-01-01')+pd.to_timedelta(rng.randint(0,365*24*3600,n),unit='s'),
+		})
+
+# name -> (chart function, keyword arguments)
+CHARTS=[
+	('pieChart',pydcjs.pieChart,{'dim':'name'}),
+	('rowChart',pydcjs.rowChart,{'dim':'cat'}),
+	('barChart',pydcjs.barChart,{'dim':'i'}),
+	('barChart_bins',pydcjs.barChart,{'dim':'x','bins':50}),
+	('lineChart_bins',pydcjs.lineChart,{'dim':'v','bins':100}),
+	('boxplot',pydcjs.boxplot,{'dim':'cat','group':'v'}),
+	('scatterPlot',pydcjs.scatterPlot,{'dim':['i','j']}),
+	('scatterPlot_pack',pydcjs.scatterPlot,{'dim':['x','y'],'pack':True,'resolution':256}),
+	('bubbleChart',pydcjs.bubbleChart,{'dim':['i','j','cat']}),
+	('heatmap',pydcjs.heatmap,{'dim':['i','j','v']}),
+	('heatmap_pack',pydcjs.heatmap,{'dim':['i','j','v'],'pack':True}),
+	]
+
+class Capture(object):
+	# stands in for IPython.display.display and counts what would be emitted
+	def __init__(self):
+		self.bytes=0
+		self.outputs=0
+
+	def __call__(self,*objs,**kwargs):
+		for obj in objs:
+			data=getattr(obj,'data',None)
+			self.bytes+=len(data.encode('utf-8')) if isinstance(data,str) else 0
+			self.outputs+=1
+
+def measure(call):
+	capture=Capture()
+	display=main.display
+	main.display=capture
+	tracemalloc.start()
+	try:
+		with open(os.devnull,'w') as devnull, contextlib.redirect_stdout(devnull):
+			start=time.perf_counter()
+			call()
+			seconds=time.perf_counter()-start
+		peak=tracemalloc.get_traced_memory()[1]
+	finally:
+		tracemalloc.stop()
+		main.display=display
+	return {'seconds':seconds,'peak_bytes':peak,'payload_bytes':capture.bytes,'outputs':capture.outputs}
+
+def run(sizes,repeat=1):
+	results=[]
+	for n in sizes:
+		df=frame(n)
+		for columnar in (False,True):
+			fmt='columnar' if columnar else 'records'
+			def set_df():
+				# a cache hit would skip serialization
+				main._cache['frames'].clear()
+				pydcjs.set_df(df,columnar=columnar)
+			best=min((measure(set_df) for _ in range(repeat)),key=lambda r:r['seconds'])
+			results.append(dict(case='set_df_'+fmt,rows=n,**best))
+			print('{rows:>9} {case:<24} {seconds:9.3f} s {payload_bytes:>12} B'.format(**results[-1]))
+			if not columnar:
+				continue
+			for figure,(name,chart,kwargs) in enumerate(CHARTS,1):
+				best=min((measure(lambda:chart(figure,**kwargs)) for _ in range(repeat)),key=lambda r:r['seconds'])
+				results.append(dict(case=name,rows=n,**best))
+				print('{rows:>9} {case:<24} {seconds:9.3f} s {payload_bytes:>12} B'.format(**results[-1]))
+	return results
+
+def compare(results,baseline,threshold):
+	# cases slower, larger or more memory hungry than the baseline by more than threshold
+	before=dict(((r['case'],r['rows']),r) for r in baseline['results'])
+	regressions=[]
+	for r in results:
+		old=before.get((r['case'],r['rows']))
+		if old is None:
+			continue
+		for key in ('seconds','peak_bytes','payload_bytes'):
+			# timings of a few milliseconds are mostly noise
+			if key=='seconds' and r[key]-old[key]<0.005:
+				continue
+			if old[key] and r[key]>old[key]*(1+threshold):
+				regressions.append('{case} ({rows} rows): {key} {old:.4g} -> {new:.4g}'\
+					.format(case=r['case'],rows=r['rows'],key=key,old=old[key],new=r[key]))
+	return regressions
+
+if __name__=='__main__':
+	parser=argparse.ArgumentParser(description='pydcjs serialization benchmarks')
+	parser.add_argument('--sizes',type=int,nargs='+',default=SIZES)
+	parser.add_argument('--repeat',type=int,default=1)
+	parser.add_argument('--out',default='bench.json')
+	parser.add_argument('--compare',default=None,help='results of an earlier run')
+	parser.add_argument('--threshold',type=float,default=0.2)
+	args=parser.parse_args()
+	results=run(args.sizes,args.repeat)
+	with open(args.out,'w') as f:
+		json.dump({'version':pydcjs.__version__,'python':platform.python_version()\
+				,'pandas':pd.__version__,'numpy':np.__version__,'results':results},f,indent=1)
+	print('wrote '+args.out)
+	if args.compare:
+		with open(args.compare) as f:
+			regressions=compare(results,json.load(f),args.threshold)
+		for line in regressions:
+			print('REGRESSION '+line)
+		sys.exit(1 if regressions else 0)
@@ -0,0 +1,301 @@
+#coding: utf-8
+
+import numpy as np
+import pandas as pd
+
+# Kernel-side crossfilter for frames too large to ship to the browser.
+# Rows carry one filter bit per dimension (a row is selected when all of its
+# bits are clear), dimensions keep a sorted index so range filters only touch
+# the rows that enter or leave the selection, and groups are kept up to date
+# with bincount over those rows. Only group.all() goes to the browser.
+
+def _minus(a,b):
+	# positions of interval a that are not in interval b
+	return [(s,e) for s,e in ((a[0],min(a[1],b[0])),(max(a[0],b[1]),a[1])) if s<e]
+
+def _jsonable(v):
+	if isinstance(v,tuple):
+		return [_jsonable(x) for x in v]
+	if isinstance(v,np.generic):
+		v=v.item()
+	if isinstance(v,float) and not np.isfinite(v):
+		return None
+	return v
+
+def _codes(column):
+	# sortable integer codes of a column and the key of each code; missing
+	# values get the last code (None), as in the columnar payload
+	try:
+		codes,uniques=pd.factorize(column,sort=True)
+	except TypeError:
+		codes,uniques=pd.factorize(column)
+	keys=np.empty(len(uniques)+1,dtype=object)
+	keys[:-1]=list(uniques)
+	return np.where(codes<0,len(uniques),codes).astype('int64'),keys
+
+class Crossfilter(object):
+	def __init__(self,df):
+		self.df=df.reset_index()
+		self.filters=np.zeros(len(self.df),dtype='uint64')
+		self.dimensions={}
+		self.groups={}
+		self._bits=0
+		self._ids=0
+
+	def size(self):
+		return len(self.df)
+
+	def dimension(self,columns,values=None):
+		free=[b for b in range(64) if not self._bits&(1<<b)]
+		if not free:
+			raise ValueError('a Crossfilter supports at most 64 dimensions')
+		self._bits|=1<<free[0]
+		dim=Dimension(self,columns,free[0],values)
+		self.dimensions[dim.id]=dim
+		return dim
+
+	def selected(self):
+		return self.filters==0
+
+	def all(self):
+		return dict((id,group.all()) for id,group in self.groups.items())
+
+	def handle(self,data):
+		# {'dim': id, 'filters': [...]} sent by pydcjs.remoteFilterHandler;
+		# a chart drawn again may still send for its disposed dimension
+		dim=self.dimensions.get(data['dim'])
+		if dim is not None:
+			dim.filter(data['filters'])
+		return {'type':'groups','groups':self.all()}
+
+	def _id(self,prefix):
+		# ids stay unique after dimensions and groups are disposed
+		self._ids+=1
+		return '%s%d'%(prefix,self._ids-1)
+
+	def _update(self,dim,entering,leaving):
+		self.filters[entering]&=~dim.bit
+		self.filters[leaving]|=dim.bit
+		for group in self.groups.values():
+			if group.dimension is not dim:
+				group._update(dim.bit,entering,leaving)
+
+class Dimension(object):
+	def __init__(self,cf,columns,bit,values=None):
+		self.cf=cf
+		self.id=cf._id('d')
+		self.columns=columns
+		self.bit=np.uint64(1<<bit)
+		self.bit_index=bit
+		self.groups=[]
+		self.single=not isinstance(columns,(list,tuple))
+		if values is not None:
+			self.values=np.asarray(values)
+			self.keys_of=None
+		elif not self.single or not (pd.api.types.is_numeric_dtype(cf.df[columns])\
+				or cf.df[columns].dtype.kind=='M'):
+			# composite and text keys: per-column codes, combined into one
+			# sortable integer
+			self.values=np.zeros(cf.size(),dtype='int64')
+			self.uniques=[]
+			self.lookup=[]
+			for col in ([columns] if self.single else columns):
+				codes,keys=_codes(cf.df[col])
+				self.values=self.values*len(keys)+codes
+				self.uniques.append(keys)
+				self.lookup.append(dict((k,i) for i,k in enumerate(keys)))
+			self.keys_of=self._decode
+		else:
+			self.values=np.asarray(cf.df[columns])
+			if self.values.dtype.kind=='M':
+				# epoch ms, the keys and range filters of the page's time axes;
+				# NaT becomes NaN, which sorts last and is left out of groups
+				missing=np.isnat(self.values)
+				self.values=self.values.astype('datetime64[ms]').astype('int64').astype('float64')
+				self.values[missing]=np.nan
+			self.keys_of=None
+		self.index=np.argsort(self.values,kind='mergesort')
+		self.sorted=self.values[self.index]
+		self.range=(0,cf.size())
+
+	def _decode(self,codes):
+		keys=[]
+		for uniques in reversed(self.uniques):
+			keys.append(uniques[codes%len(uniques)])
+			codes=codes//len(uniques)
+		if self.single:
+			return list(keys[0])
+		return list(zip(*reversed(keys)))
+
+	def _encode(self,key):
+		code=0
+		for lookup,k in zip(self.lookup,[key] if self.single else key):
+			pos=lookup.get(k)
+			if pos is None:
+				return None
+			code=code*len(lookup)+pos
+		return code
+
+	def group(self,reduce='count',value=None):
+		group=Group(self,reduce,value)
+		self.groups.append(group)
+		self.cf.groups[group.id]=group
+		return group
+
+	def filter_all(self):
+		self._select_range(0,self.cf.size())
+
+	def dispose(self):
+		# like crossfilter's dimension.dispose(): the filter is lifted, and the
+		# filter bit and the groups are released
+		self.filter_all()
+		for group in self.groups:
+			del self.cf.groups[group.id]
+		self.groups=[]
+		self.cf._bits&=~(1<<self.bit_index)
+		del self.cf.dimensions[self.id]
+
+	def filter_range(self,lo,hi):
+		if self.keys_of is not None:
+			raise ValueError('range filters are not supported on composite or text dimensions')
+		self._select_range(np.searchsorted(self.sorted,lo,'left')\
+						,np.searchsorted(self.sorted,hi,'left'))
+
+	def filter_exact(self,value):
+		self.filter_in([value])
+
+	def filter_in(self,keys):
+		self._select_mask(self._mask(keys,[]))
+
+	def filter(self,filters):
+		# dc.js filters: plain keys, or {'range': [lo, hi]}
+		if not filters:
+			return self.filter_all()
+		ranges=[f['range'] for f in filters if isinstance(f,dict)]
+		keys=[tuple(f) if isinstance(f,list) else f for f in filters if not isinstance(f,dict)]
+		if len(ranges)==1 and not keys:
+			return self.filter_range(*ranges[0])
+		self._select_mask(self._mask(keys,ranges))
+
+	def _mask(self,keys,ranges):
+		mask=np.zeros(self.cf.size(),dtype=bool)
+		bounds=[(np.searchsorted(self.sorted,lo,'left'),np.searchsorted(self.sorted,hi,'left')) for lo,hi in ranges]
+		for key in keys:
+			if self.keys_of is not None:
+				key=self._encode(key)
+				if key is None:
+					continue
+			bounds.append((np.searchsorted(self.sorted,key,'left'),np.searchsorted(self.sorted,key,'right')))
+		for lo,hi in bounds:
+			mask[self.index[lo:hi]]=True
+		return mask
+
+	def _select_range(self,lo,hi):
+		if self.range is None:
+			mask=np.zeros(self.cf.size(),dtype=bool)
+			mask[self.index[lo:hi]]=True
+			self._select_mask(mask)
+		else:
+			entering=[self.index[s:e] for s,e in _minus((lo,hi),self.range)]
+			leaving=[self.index[s:e] for s,e in _minus(self.range,(lo,hi))]
+			self.cf._update(self,np.concatenate(entering or [[]]).astype('int64')\
+							,np.concatenate(leaving or [[]]).astype('int64'))
+		self.range=(lo,hi)
+
+	def _select_mask(self,mask):
+		current=(self.cf.filters&self.bit)==0
+		self.cf._update(self,np.flatnonzero(mask&~current),np.flatnonzero(~mask&current))
+		self.range=(0,self.cf.size()) if mask.all() else None
+
+class Group(object):
+	def __init__(self,dimension,reduce='count',value=None):
+		if reduce not in ('count','sum','mean','min','max','distinct'):
+			raise ValueError("unknown reduce %r"%(reduce,))
+		cf=dimension.cf
+		self.dimension=dimension
+		self.id=cf._id('g')
+		self.reduce=reduce
+		s=dimension.sorted
+		same=s[1:]==s[:-1]
+		if s.dtype.kind=='f':
+			same|=np.isnan(s[1:])&np.isnan(s[:-1])
+		self.starts=np.flatnonzero(np.r_[True,~same]) if len(s) else np.zeros(0,dtype='int64')
+		keys=s[self.starts]
+		self.keys=dimension.keys_of(keys) if dimension.keys_of else list(keys)
+		self.codes=np.empty(len(s),dtype='int64')
+		self.codes[dimension.index]=np.cumsum(np.r_[True,~same])-1 if len(s) else []
+		if value is None:
+			self.weights=None
+		else:
+			# rows missing the value are left out, as by the page's reducers
+			column=cf.df[value]
+			self.valid=column.notna().values
+			if reduce=='distinct':
+				# distinct values as codes; only their identity matters
+				self.weights=pd.factorize(column)[0].astype('float64')
+			else:
+				self.weights=np.where(self.valid,pd.to_numeric(column,errors='coerce'),0.)
+		rows=np.flatnonzero((cf.filters&~dimension.bit)==0)
+		self.counts=np.zeros(len(self.starts),dtype='int64')
+		self.sums=np.zeros(len(self.starts),dtype='float64')
+		self._add(rows,1)
+		if reduce in ('min','max'):
+			self._extrema()
+		if reduce=='distinct':
+			self._distinct()
+
+	def _add(self,rows,sign):
+		k=len(self.starts)
+		if self.weights is not None:
+			rows=rows[self.valid[rows]]
+		self.counts+=sign*np.bincount(self.codes[rows],minlength=k)
+		if self.weights is not None:
+			self.sums+=sign*np.bincount(self.codes[rows],weights=self.weights[rows],minlength=k)
+
+	def _extrema(self):
+		# min/max cannot be undone incrementally; reduceat over the sorted rows
+		dim=self.dimension
+		selected=(((dim.cf.filters&~dim.bit)==0)&self.valid)[dim.index]
+		fill=np.inf if self.reduce=='min' else -np.inf
+		ufunc=np.minimum if self.reduce=='min' else np.maximum
+		values=np.where(selected,self.weights[dim.index],fill)
+		self.extrema=ufunc.reduceat(values,self.starts) if len(values) else values
+
+	def _distinct(self):
+		# distinct values of the selected rows per key, recomputed like min/max
+		dim=self.dimension
+		rows=np.flatnonzero(((dim.cf.filters&~dim.bit)==0)&self.valid)
+		pairs=np.unique(np.stack([self.codes[rows],self.weights[rows].astype('int64')]),axis=1)
+		self.distinct=np.bincount(pairs[0],minlength=len(self.starts))
+
+	def _update(self,bit,entering,leaving):
+		other=~(self.dimension.bit|bit)
+		filters=self.dimension.cf.filters
+		self._add(entering[(filters[entering]&other)==0],1)
+		self._add(leaving[(filters[leaving]&other)==0],-1)
+		if self.reduce in ('min','max') and (len(entering) or len(leaving)):
+			self._extrema()
+		if self.reduce=='distinct' and (len(entering) or len(leaving)):
+			self._distinct()
+
+	def value(self,i):
+		if self.reduce=='count':
+			return self.counts[i]
+		if self.reduce=='sum':
+			return self.sums[i]
+		if self.reduce=='mean':
+			ave=self.sums[i]/self.counts[i] if self.counts[i] else 0
+			return {'count':_jsonable(self.counts[i]),'sum':_jsonable(self.sums[i]),'ave':_jsonable(ave)}
+		if self.reduce=='distinct':
+			return self.distinct[i]
+		return self.extrema[i]
+
+	def all(self):
+		out=[]
+		for i,key in enumerate(self.keys):
+			# NaN and NaT keys are left out, missing text keys stay (None)
+			plain=_jsonable(key)
+			if plain is None and key is not None:
+				continue
+			out.append({'key':plain,'value':_jsonable(self.value(i))})
+		return out
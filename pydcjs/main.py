@@ -1,10 +1,67 @@
 #coding: utf-8
 
+import os
+import io
+import json
+import base64
+import hashlib
+import time
+import datetime
+import zlib
+import re
+import collections
+import functools
 import pandas as pd
 from IPython.display import HTML, Javascript, display
 import numpy as np
+from .engine import Crossfilter
 
-def load_js(online=True):
+_dir=os.path.dirname(os.path.abspath(__file__))
+
+def _runtime_js():
+	with open(os.path.join(_dir,'runtime.js')) as f:
+		return f.read()
+
+def _asset(name):
+	# d3, crossfilter, dc.js and their css, shipped in pydcjs/src
+	with io.open(os.path.join(_dir,'src',name),encoding='utf-8') as f:
+		return f.read()
+
+def _dc_js():
+	# the dc.js build ends with the UMD wrapper that calls _dc(d3, crossfilter);
+	# a copy cut short before it defines nothing and would break the page
+	source=_asset('dc.js')
+	if len(re.findall(r'\b_dc\b',source))<2:
+		raise RuntimeError('pydcjs/src/dc.js is incomplete; replace it with the full dc 2.0.0-beta.32 build'\
+						' (https://cdnjs.cloudflare.com/ajax/libs/dc/2.0.0-beta.32/dc.js)')
+	return source
+
+# load_js(online=False): the packaged libraries run once per page (per
+# pydcjs version) and are registered as require.js modules, without any
+# request to the notebook server; crossfilter's source is kept for the worker
+_offline_js="""(function() {
+	var version = '{version}';
+	if (window.pydcjsAssets && window.pydcjsAssets.version === version) {
+		return;
+	}
+	var style = document.createElement('style');
+	style.textContent = {css};
+	document.head.appendChild(style);
+	var run = function(source) {
+		// without define/module/exports the libraries attach to window
+		new Function('define', 'module', 'exports', source).call(window);
+	};
+	var sources = {d3: {d3}, crossfilter: {crossfilter}, dc: {dc}};
+	['d3', 'crossfilter', 'dc'].forEach(function(name) {
+		run(sources[name]);
+		require.undef(name);
+		define(name, [], function() { return window[name]; });
+	});
+	window.pydcjsAssets = {version: version, crossfilter: sources.crossfilter};
+})();"""
+
+def load_js(online=True,performance=None,profile=None):
+	# performance=True, profile=True: same as setting them in config
 	if online:
 		display(Javascript("""require.config({
 	    paths: {
@@ -22,21 +79,21 @@ def load_js(online=True):
 	    HTML('<link href="https://cdnjs.cloudflare.com/ajax/libs/dc/1.7.5/dc.min.css" rel="stylesheet" type="text/css">'),
 	    HTML('<link href="https://cdnjs.cloudflare.com/ajax/libs/semantic-ui/2.2.10/components/grid.min.css" rel="stylesheet" type="text/css">'))
 	else:
-		display(Javascript("""require.config({
-	    paths: {
-	        'd3': '../src/d3.min',
-	        'crossfilter': '../src/crossfilter.min',
-	        'dc': '../src/dc',
-	    },
-	    shim: {
-	        'crossfilter': {
-	            deps: [],
-	            exports: 'crossfilter'
-	        }
-	    }
-	    });"""),
-	    HTML('<link href="../src/dc.min.css" rel="stylesheet" type="text/css">'),
-	    HTML('<link href="../src/grid.min.css" rel="stylesheet" type="text/css">'))
+		from . import __version__
+		dc_js=_dc_js()
+		display(Javascript(_offline_js\
+		.replace('{version}',__version__)\
+		.replace('{css}',json.dumps(_asset('dc.min.css')+_asset('grid.min.css')))\
+		.replace('{d3}',json.dumps(_asset('d3.min.js')))\
+		.replace('{crossfilter}',json.dumps(_asset('crossfilter.min.js')))\
+		.replace('{dc}',json.dumps(dc_js))))
+	if performance is not None:
+		config['performance']=performance
+	if profile is not None:
+		config['profile']=profile
+	display(Javascript(_runtime_js()))
+	# a fresh page has no cached frames
+	_cache['frames'].clear()
 
 def figure(n=4,list=True):
 	html=""
@@ -66,37 +123,1159 @@ def test():
 	})
 	"""))
 
-def set_df(df):
+# numpy dtype -> typed array name used by the columnar payload
+_typed={'float64':'Float64','float32':'Float32','int8':'Int8','int16':'Int16','int32':'Int32'\
+		,'uint8':'Uint8','uint16':'Uint16','uint32':'Uint32','bool':'Uint8'}
+
+# Int32 code of a missing value in datetime and fixed precision columns
+_missing_code=2**31-1
+
+def _b64(values):
+	return base64.b64encode(values.astype(values.dtype.newbyteorder('<')).tobytes()).decode('ascii')
+
+def _encode_times(values):
+	# offsets from the earliest timestamp in the coarsest unit (day, hour,
+	# minute, second, ms) that keeps every value exact and fits in an Int32
+	missing=np.isnat(values)
+	ms=values.astype('datetime64[ms]').astype('int64')
+	present=ms[~missing]
+	base=int(present.min()) if len(present) else 0
+	offsets=present-base
+	for unit in (86400000,3600000,60000,1000,1):
+		if (offsets%unit).any() or (len(offsets) and offsets.max()//unit>=_missing_code):
+			continue
+		codes=np.full(len(ms),_missing_code,dtype='int32')
+		codes[~missing]=offsets//unit
+		return {'type':'Int32','data':_b64(codes),'base':base,'unit':unit}
+	values=ms.astype('float64')
+	values[missing]=np.inf
+	return {'type':'Float64','data':_b64(values)}
+
+def _encode_floats(values,precision=None):
+	# precision: None, 'float32', or a number of decimals kept as Int32
+	# codes when they fit; NaN becomes Infinity so dimensions stay sorted
+	if precision=='float32':
+		values=values.astype('float32')
+	elif precision is not None:
+		scale=10**int(precision)
+		scaled=np.round(values*scale)
+		finite=np.isfinite(scaled)
+		if not finite.any() or np.abs(scaled[finite]).max()<_missing_code:
+			codes=np.full(len(values),_missing_code,dtype='int32')
+			codes[finite]=scaled[finite]
+			return {'type':'Int32','data':_b64(codes),'scale':scale}
+		values=np.round(values,int(precision))
+	if values.dtype.name not in _typed:
+		values=values.astype('float64')
+	missing=np.isnan(values)
+	if missing.any():
+		values=np.where(missing,np.inf,values).astype(values.dtype)
+	return {'type':_typed[values.dtype.name],'data':_b64(values)}
+
+def _encode_column(s,precision=None):
+	values=s.values
+	if not isinstance(values,np.ndarray) and getattr(s.dtype,'kind',None) in ('f','i','u','b'):
+		# nullable extension dtypes: missing values go through the float encoding
+		values=s.to_numpy(dtype='float64',na_value=np.nan)
+	if not isinstance(values,np.ndarray) or values.dtype.kind not in 'fiubM':
+		return {'type':'json','data':json.loads(s.to_json(orient='values'))}
+	if values.dtype.kind=='M':
+		return _encode_times(values)
+	if values.dtype.kind=='f':
+		return _encode_floats(values,precision)
+	if values.dtype.kind in 'iu' and values.dtype.name not in _typed:
+		if values.size==0 or (values.min()>=-2**31 and values.max()<2**31):
+			values=values.astype('int32')
+		else:
+			values=values.astype('float64')
+	return {'type':_typed[values.dtype.name],'data':_b64(values)}
+
+def _precision(precision,column):
+	# set_df(precision=...) for one column: a dict per column, or one for all
+	if isinstance(precision,dict):
+		return precision.get(column)
+	return precision
+
+def _round(values,precision):
+	if precision=='float32':
+		# float32 keeps about 7 significant digits
+		with np.errstate(all='ignore'):
+			finite=np.isfinite(values)&(values!=0)
+			scale=10.**(6-np.floor(np.log10(np.abs(np.where(finite,values,1)))))
+			return np.where(finite,np.round(values*scale)/scale,values)
+	return np.round(values,int(precision))
+
+def _records_json(df,precision=None,literal=True):
+	# missing numbers and datetimes are Infinity on the page, as in the columnar
+	# payload: written as such into a JS literal, while JSON (comm, export) can
+	# only say null and lists the columns for pydcjs.records to fill
+	if precision is not None:
+		df=df.copy(deep=False)
+		for c in df.columns:
+			p=_precision(precision,c)
+			if p is not None and df[c].dtype.kind=='f':
+				df[c]=_round(df[c].values,p)
+	text=df.to_json(orient='records')
+	missing=[c for c in df.columns if df[c].dtype.kind in 'fiuM' and df[c].isna().any()]
+	if not missing:
+		return text
+	if not literal:
+		return '{"rows":%s,"missing":%s}'%(text,json.dumps([str(c) for c in missing]))
+	for c in missing:
+		# '"c":null', with the column name escaped as to_json does
+		null=pd.Series({c:None}).to_json()[1:-1]
+		text=text.replace(null,null[:-len('null')]+'Infinity')
+	return text
+
+def _numbers(s):
+	# a column as the numbers the page sees: datetimes in epoch ms, missing as NaN
+	if s.dtype.kind=='M':
+		values=s.values
+		ms=values.astype('datetime64[ms]').astype('int64').astype('float64')
+		ms[np.isnat(values)]=np.nan
+		return ms
+	return s.to_numpy(dtype='float64',na_value=np.nan)
+
+def _epoch_ms(v):
+	# Timestamps in xlim -> the epoch milliseconds of datetime columns
+	if isinstance(v,(datetime.datetime,datetime.date,np.datetime64)):
+		return pd.Timestamp(v).value//10**6
+	return v
+
+def _encode_categories(s):
+	# object/string/category columns -> small integer codes plus one label table
+	if isinstance(s.dtype,pd.CategoricalDtype):
+		codes,labels=s.cat.codes.values.astype('int64'),list(s.cat.categories)
+	elif s.dtype.kind=='O' or pd.api.types.is_string_dtype(s.dtype):
+		try:
+			codes,labels=pd.factorize(s,sort=True)
+		except TypeError:
+			return None
+		labels=list(labels)
+	else:
+		return None
+	if len(labels)>=65535:
+		return None
+	# missing values get the last code so sorting on codes stays valid
+	codes=np.where(codes<0,len(labels),codes)
+	labels=json.loads(pd.Series(labels+[None],dtype=object).to_json(orient='values'))
+	return pd.Series(codes.astype('uint8' if len(labels)<=256 else 'uint16')),labels
+
+def _columnar_json(df,precision=None):
+	columns=[]
+	labels={}
+	for c in df.columns:
+		encoded=_encode_categories(df[c])
+		if encoded is None:
+			columns.append(dict(name=str(c),**_encode_column(df[c],_precision(precision,c))))
+		else:
+			columns.append(dict(name=str(c),**_encode_column(encoded[0])))
+			labels[str(c)]=encoded[1]
+	return json.dumps({'n':len(df),'columns':columns,'labels':labels},separators=(',',':')),labels
+
+def _state(name):
+	# charts: per anchor, how rows map to the keys of its dimension; filters:
+	# per anchor, the filters the page sent back; keys, masks: get_filtered caches;
+	# series: per anchor, the lines of time-series lineCharts; top: per anchor,
+	# the levels of top-K pie and row charts; summary: column aggregates of a
+	# sampled file or chunk source; remote: per anchor, the engine dimension
+	# of its chart; load: the chunks of a chunked set_df and their timings
+	return {'name':name,'df':None,'engine':None,'labels':{},'hash':None,'columnar':False\
+		,'pending':[],'rows':0,'derived':{},'worker':False,'index':[None]\
+		,'charts':{},'filters':{},'keys':{},'masks':{'df':None,'masks':{}},'scripts':{},'precision':None,'series':{},'top':{},'summary':None,'remote':{},'load':None}
+
+# frames by set_df name; chart functions draw from _current, the frame of the
+# last set_df or the one named by their data argument
+_datasets={}
+_current=_state('default')
+_layout={'dashboard':None}
+
+def _use(data):
+	# only for the duration of a call wrapped by _keeps_current: the default
+	# frame stays the one of the last set_df
+	global _current
+	if data is not None:
+		if data not in _datasets:
+			raise ValueError("no frame named %r; call set_df(df,name=%r) first"%(data,data))
+		_current=_datasets[data]
+	return _current
+
+def _keeps_current(fn):
+	# restore _current after fn, which may switch it with _use(data)
+	@functools.wraps(fn)
+	def call(*args,**kwargs):
+		global _current
+		previous=_current
+		try:
+			return fn(*args,**kwargs)
+		finally:
+			_current=previous
+	return call
+
+def _df(state=None):
+	# batches from append_df are only concatenated when a chart needs the rows
+	state=_current if state is None else state
+	if state['pending']:
+		df=pd.concat([state['df']]+state['pending'],ignore_index=True)
+		state['df']=df.iloc[len(df)-state['rows']:].reset_index(drop=True)
+		state['pending']=[]
+	return state['df']
+
+def _frame_js(state,anchor=None):
+	# the frame's rows and crossfilter as the local cfdata and cf of a script;
+	# with an anchor, the chart drawn there is released when the frame is disposed
+	if anchor is None:
+		return '\n\tvar frame = pydcjs.frames[%s];'%json.dumps(state['name'])\
+			+'\n\tvar cf = frame.cf, cfdata = frame.cfdata;'
+	return '\n\tvar frame = pydcjs.use(%s, %s);'%(json.dumps(state['name']),json.dumps(anchor))\
+		+'\n\tvar cf = frame.cf, cfdata = frame.cfdata;'
+
+# canvas_threshold: scatterPlot/heatmap switch to canvas above this many points
+# performance: no transitions, brush redraws debounced by brush_delay ms, and
+# charts added with redrawAll instead of renderAll
+# profile: the page times its stages with performance.now(), see profile()
+# read_chunksize: rows read at a time when set_df gets a file path
+config={'canvas_threshold':50000,'performance':False,'brush_delay':100,'profile':False\
+		,'read_chunksize':100000}
+
+def _configure_js():
+	if config['profile']:
+		_listen('profile',_spans)
+	return 'pydcjs.configure(%s);'%json.dumps({'performance':bool(config['performance'])\
+			,'brushDelay':config['brush_delay'],'profile':bool(config['profile'])})
+
+# spans sent by the page while config['profile'] is on
+_profile={'spans':[]}
+
+def _spans(data):
+	_profile['spans'].extend(data['spans'])
+
+def profile(clear=False):
+	# one row per span: the filter event it belongs to (0 until the first
+	# filter), the chart ('set_df' for the frame), the stage (parse,
+	# crossfilter, dimension, group, render, redraw, filter) and its
+	# start and duration in ms
+	df=pd.DataFrame(_profile['spans'],columns=['event','chart','stage','start','ms'])
+	if clear:
+		_profile['spans']=[]
+	return df
+
+_comm={'handlers':{},'registered':False}
+
+def _listen(type,handler):
+	# route messages sent by pydcjs.send(type, ...) in the browser
+	_comm['handlers'][type]=handler
+	if not _comm['registered']:
+		from IPython import get_ipython
+		ip=get_ipython()
+		if ip is None or not hasattr(ip,'kernel'):
+			return
+		ip.kernel.comm_manager.register_target('pydcjs',_comm_open)
+		_comm['registered']=True
+
+def _comm_open(comm,msg):
+	comm.on_msg(lambda msg:_comm_msg(comm,msg))
+
+def _comm_msg(comm,msg):
+	data=msg['content']['data']
+	handler=_comm['handlers'].get(data.get('type'))
+	if handler is not None:
+		reply=handler(data)
+		if reply is not None:
+			comm.send(reply)
+
+# the frames pydcjs.cache holds on the page, by hash: same size, same least
+# recently used order, so that set_df never counts on a frame the page evicted
+_cache={'frames':collections.OrderedDict(),'size':4,'hits':0,'misses':0}
+
+def _remember(hash,labels):
+	# as pydcjs.cacheFrame: a known hash keeps its place
+	if hash is None:
+		return
+	_cache['frames'][hash]=labels
+	while len(_cache['frames'])>_cache['size']:
+		_cache['frames'].popitem(last=False)
+
+def _frame_hash(df,columnar,precision=None):
+	try:
+		values=pd.util.hash_pandas_object(df,index=True).values
+	except TypeError:
+		return None
+	h=hashlib.sha1(values.tobytes())
+	h.update(repr((list(map(str,df.columns)),list(map(str,df.dtypes)),list(df.index.names),columnar,precision)).encode('utf-8'))
+	return h.hexdigest()
+
+def _payload(df,columnar,precision=None,literal=True):
+	if columnar:
+		return _columnar_json(df,precision)
+	return _records_json(df,precision,literal),{}
+
+def _resend(data):
+	# the page lost a cached frame (evicted); send it again over the comm
+	state=_datasets.get(data.get('name'))
+	if state is None or data['hash']!=state['hash']:
+		return None
+	payload,labels=_payload(_df(state),state['columnar'],state['precision'],literal=False)
+	_remember(data['hash'],labels)
+	return {'type':'frame','name':state['name'],'hash':data['hash'],'columnar':state['columnar'],'data':payload}
+
+def _remote_filter(data):
+	# dimension ids are '<name>:<id>', one kernel-side Crossfilter per frame
+	name,dim=data['dim'].rsplit(':',1)
+	state=_datasets.get(name)
+	if state is None or state['engine'] is None:
+		return None
+	reply=state['engine'].handle({'dim':dim,'filters':data['filters']})
+	reply['groups']=dict((name+':'+id,groups) for id,groups in reply['groups'].items())
+	return reply
+
+def cache_info():
+	return {'hits':_cache['hits'],'misses':_cache['misses'],'frames':len(_cache['frames'])}
+
+# set_df(chunksize=n): each frame keeps its own load (state['load']); ids
+# tell a load from the one it replaced under the same name
+_load={'id':0}
+
+def _chunk(data):
+	# the page asks for the next chunk of a frame and reports how long the
+	# previous one took
+	state=_datasets.get(data.get('name'))
+	load=None if state is None else state['load']
+	if load is None or data['id']!=load['id']:
+		return None
+	i=data['index']
+	if data.get('ms') is not None and i-1<len(load['times']):
+		load['times'][i-1]['browser_ms']=data['ms']
+	if i>=len(load['bounds']):
+		# the page cached the frame with its last chunk
+		if i==len(load['bounds']):
+			_remember(state['hash'],state['labels'])
+		return None
+	start,stop=load['bounds'][i]
+	t=time.time()
+	payload=_batch_json(_df(state).iloc[start:stop],state,literal=False)
+	load['times'].append({'chunk':i,'rows':stop-start,'bytes':len(payload)\
+						,'serialize_ms':(time.time()-t)*1000.,'browser_ms':None})
+	return {'type':'chunk','name':state['name'],'id':load['id'],'index':i,'data':payload}
+
+def load_info(data=None):
+	# per-chunk size and timings of a chunked set_df (default: the current frame)
+	state=_current if data is None else _datasets.get(data)
+	times=[] if state is None or state['load'] is None else state['load']['times']
+	return pd.DataFrame(times,columns=['chunk','rows','bytes','serialize_ms','browser_ms'])
+
+def _chunks(source,read_kwargs=None):
+	# DataFrames from a Parquet or CSV path, or from an iterator of DataFrames;
+	# read_kwargs go to ParquetFile.iter_batches or pd.read_csv
+	kwargs=dict(read_kwargs or {})
+	if not (isinstance(source,str) or hasattr(source,'__fspath__')):
+		if kwargs:
+			raise ValueError('read_kwargs needs a Parquet or CSV path, not an iterator')
+		return iter(source)
+	path=str(source)
+	if path.lower().endswith(('.parquet','.pq')):
+		import pyarrow.parquet as pq
+		kwargs.setdefault('batch_size',config['read_chunksize'])
+		return (batch.to_pandas() for batch in pq.ParquetFile(path).iter_batches(**kwargs))
+	kwargs.setdefault('chunksize',config['read_chunksize'])
+	return pd.read_csv(path,**kwargs)
+
+def _scan(source,sample,seed=0,read_kwargs=None):
+	# One pass over the chunks: a uniform reservoir sample of at most `sample`
+	# rows (algorithm R, a chunk at a time) and per-column count, missing,
+	# sum, min and max of every row. Only the sample and one chunk are held.
+	rng=np.random.RandomState(seed)
+	reservoir=None
+	stats={}
+	seen=0
+	for chunk in _chunks(source,read_kwargs):
+		for c in chunk.columns:
+			s=chunk[c]
+			st=stats.setdefault(c,{'count':0,'missing':0,'sum':None,'min':None,'max':None})
+			st['count']+=int(s.count())
+			st['missing']+=int(len(s)-s.count())
+			if s.dtype.kind in 'fiubM' and s.count():
+				if s.dtype.kind!='M':
+					st['sum']=(st['sum'] or 0)+s.sum()
+				st['min']=s.min() if st['min'] is None else min(st['min'],s.min())
+				st['max']=s.max() if st['max'] is None else max(st['max'],s.max())
+		# rows that fill the reservoir, then row t replaces a random slot with
+		# probability sample/(t+1); of two rows drawing one slot the later wins
+		fill=max(0,min(sample-seen,len(chunk)))
+		if fill:
+			reservoir=chunk.iloc[:fill] if reservoir is None else pd.concat([reservoir,chunk.iloc[:fill]])
+		slots=rng.randint(0,np.arange(seen+fill,seen+len(chunk))+1) if len(chunk)>fill else np.zeros(0,dtype='int64')
+		rows=np.flatnonzero(slots<sample)
+		if len(rows):
+			slots=slots[rows]
+			last=len(slots)-1-np.unique(slots[::-1],return_index=True)[1]
+			keep=np.ones(len(reservoir),dtype=bool)
+			keep[slots[last]]=False
+			reservoir=pd.concat([reservoir[keep],chunk.iloc[fill+rows[last]]])
+		seen+=len(chunk)
+	if reservoir is None:
+		raise ValueError('set_df got no rows')
+	summary=pd.DataFrame.from_dict(stats,orient='index',columns=['count','missing','sum','min','max'])
+	summary['mean']=[st['sum']/st['count'] if st['sum'] is not None and st['count'] else None for st in stats.values()]
+	return reservoir,summary,seen
+
+def summary(data=None):
+	# per-column aggregates over every row of a set_df file or chunk source
+	state=_current if data is None else _datasets.get(data)
+	if state is None or state['summary'] is None:
+		raise ValueError('summary() needs a frame set from a file path or chunk iterator')
+	return state['summary']
+
+def set_df(df,columnar=False,engine='browser',chunksize=None,name='default',precision=None,sample=100000,read_kwargs=None):
+	# name: charts pick the frame with data=name; a frame set again under the
+	# same name replaces the old one, whose charts and dimensions are released
+	# precision: float columns as 'float32' or rounded to a number of decimals,
+	# one setting for all of them or a dict per column
+	# df may also be a Parquet/CSV path or an iterator of DataFrames: it is
+	# read once, and the charts draw from a uniform sample of `sample` rows;
+	# read_kwargs (parse_dates, dtype, columns...) go to its reader
+	global _current
 	begin="""require(['d3', 'crossfilter', 'dc'], function(d3, crossfilter, dc) {"""
+	reset="""
+	pydcjs.dispose({name}, '{hash}');"""
 	js="""
 	//if (typeof window.cf !== 'undefined') {
 	//} else {
-	window.cfdata={data}
-	window.cf = crossfilter(cfdata);
-	console.log(cfdata)
+	var cfdata = pydcjs.time('set_df', 'parse', function() {
+		return {data};
+	});
+	var cf = pydcjs.time('set_df', 'crossfilter', function() {
+		return crossfilter(cfdata);
+	});
+	pydcjs.setFrame({name}, cfdata, cf);
+	pydcjs.cacheFrame('{hash}', cfdata, cf);
 	//}
 	"""
+	cached="""
+	if (!pydcjs.restoreFrame('{hash}', {name})) {
+		pydcjs.send('frame', {hash: '{hash}', name: {name}});
+	}
+	"""
+	load_js="""
+	pydcjs.load({id}, {name}, {chunks}, {rows}, '{hash}');
+	"""
+	worker="""
+	pydcjs.startWorker({name}, {data}, {columnar}, {labels});
+	"""
+	remote="""
+	pydcjs.setFrame({name}, {labels: {}}, null);
+	"""
 	end="""})"""
+	if engine not in ('browser','python','worker'):
+		raise ValueError("engine must be 'browser', 'python' or 'worker', not %r"%(engine,))
+	source=None
+	if not isinstance(df,pd.DataFrame):
+		df,source,rows=_scan(df,sample,read_kwargs=read_kwargs)
+	previous=_datasets.get(name)
+	_current=_datasets[name]=_state(name)
+	_current['summary']=source
+	_current['index']=list(df.index.names)
+	if source is not None:
+		print('sample: {n} of {rows} rows'.format(n=len(df),rows=rows))
+	_current['worker']=engine=='worker'
+	if engine!='python':
+		_current['df']=df.reset_index()
+	if engine=='browser':
+		_current['hash']=_frame_hash(_current['df'],columnar,precision)
+	if previous is not None and previous['hash']!=_current['hash']\
+			and not any(state['hash']==previous['hash'] for state in _datasets.values()):
+		# the page uncaches the replaced crossfilter unless it holds these rows
+		_cache['frames'].pop(previous['hash'],None)
+	begin+=_configure_js()+reset.replace('{name}',json.dumps(name)).replace('{hash}',str(_current['hash']))
+	if engine=='python':
+		# keep the rows in the kernel, charts only receive aggregated groups
+		_current['engine']=Crossfilter(df)
+		_current['df']=_current['engine'].df
+		_current['pending']=[]
+		_current['rows']=len(df)
+		_listen('filter',_remote_filter)
+		display(Javascript(begin\
+		+remote.replace('{name}',json.dumps(name))\
+		+end))
+		print('engine: python ({n} rows kept in the kernel)'.format(n=len(df)))
+		print(df.columns)
+		return
+	_current['engine']=None
+	_current['pending']=[]
+	_current['rows']=len(df)
+	_current['derived']={}
+	_current['columnar']=columnar
+	_current['precision']=precision
+	if engine=='worker':
+		# rows, dimensions and groups live in a Web Worker, the page only
+		# receives group results; the frame is not cached on the page
+		_current['hash']=None
+		payload,_current['labels']=_payload(_current['df'],columnar,precision)
+		display(Javascript(begin\
+		+worker.replace('{name}',json.dumps(name))\
+		.replace('{columnar}',json.dumps(columnar))\
+		.replace('{labels}',json.dumps({'labels':_current['labels']}))\
+		.replace('{data}',payload)\
+		+end))
+		print('payload: {size} bytes ({fmt}, worker)'.format(size=len(payload),fmt='columnar' if columnar else 'records'))
+		print(df.columns)
+		return
+	if _current['hash'] is not None and _current['hash'] in _cache['frames']:
+		# unchanged frame: no serialization, no transfer, no new crossfilter
+		_cache['hits']+=1
+		# restoreFrame makes it the most recently used
+		_current['labels']=_cache['frames'][_current['hash']]=_cache['frames'].pop(_current['hash'])
+		_listen('frame',_resend)
+		display(Javascript(begin\
+		+cached.replace('{hash}',_current['hash'])\
+		.replace('{name}',json.dumps(name))\
+		+end))
+		print('payload: cached ({hash})'.format(hash=_current['hash'][:12]))
+		print(df.columns)
+		return
+	_cache['misses']+=1
+	chunked=chunksize is not None and len(df)>chunksize
+	if chunked:
+		# the first chunk is built here, the page pulls the others over the comm
+		_load['id']+=1
+		load=_current['load']={'id':_load['id'],'times':[]\
+			,'bounds':[(start,min(start+chunksize,len(df))) for start in range(0,len(df),chunksize)]}
+		t=time.time()
+		payload,_current['labels']=_payload(_current['df'].iloc[:chunksize],columnar,precision,literal=False)
+		load['times'].append({'chunk':0,'rows':chunksize,'bytes':len(payload)\
+							,'serialize_ms':(time.time()-t)*1000.,'browser_ms':None})
+		_listen('chunk',_chunk)
+	else:
+		payload,_current['labels']=_payload(_current['df'],columnar,precision,literal=False)
+	# a JSON string parsed in the 'parse' span: a JS literal would be compiled
+	# with the script, before the span starts
+	data='pydcjs.{fn}(JSON.parse({text}))'.format(fn='fromColumns' if columnar else 'records'\
+		,text=json.dumps(payload))
+	if chunked:
+		display(HTML("""<div id="pydcjs-load-{id}"><progress max="{n}" value="{k}"></progress> <span></span></div>"""\
+				.format(id=load['id'],n=len(df),k=chunksize)))
+		display(Javascript(begin\
+		+js.replace('{hash}','None')\
+		.replace('{name}',json.dumps(name))\
+		.replace('{data}',data)\
+		+load_js.replace('{id}',str(load['id']))\
+		.replace('{name}',json.dumps(name))\
+		.replace('{chunks}',str(len(load['bounds'])))\
+		.replace('{rows}',str(len(df)))\
+		.replace('{hash}',str(_current['hash']))\
+		+end))
+		print('payload: {size} bytes in the first of {chunks} chunks ({fmt})'\
+			.format(size=len(data),chunks=len(load['bounds']),fmt='columnar' if columnar else 'records'))
+		print(df.columns)
+		return
+	_remember(_current['hash'],_current['labels'])
 	display(Javascript(begin\
-	+js.replace('{data}',df.reset_index().to_json(orient='records'))\
+	+js.replace('{hash}',str(_current['hash']))\
+	.replace('{name}',json.dumps(name))\
+	.replace('{data}',data)\
 	+end))
+	print('payload: {size} bytes ({fmt})'.format(size=len(data),fmt='columnar' if columnar else 'records'))
 	print(df.columns)
 
+def _sync(data):
+	# {'frame': name, 'charts': {anchor: filters}} sent by pydcjs.syncFilters
+	state=_datasets.get(data['frame'])
+	if state is None:
+		return None
+	for anchor,filters in data['charts'].items():
+		if filters:
+			state['filters'][anchor]=filters
+		else:
+			state['filters'].pop(anchor,None)
+	if state['series']:
+		# time-series lineCharts follow the new selection and brushed ranges
+		return {'type':'series','charts':dict((anchor,_series(state,anchor)) for anchor in state['series'])}
+
+def _keys(state,anchor,df):
+	# per-row keys of a chart's dimension, computed once per version of the rows
+	cached=state['keys'].get(anchor)
+	if cached is None or cached[0] is not df:
+		rows=state['charts'][anchor]['rows']
+		keys=[]
+		for k in (rows(df) if callable(rows) else [df[c] for c in rows]):
+			k=pd.Series(k)
+			if k.dtype.kind=='M':
+				k=pd.Series(_numbers(k))
+			keys.append(k)
+		cached=state['keys'][anchor]=(df,keys)
+	return cached[1]
+
+def _chart_mask(keys,labels,filters):
+	# one chart's filters, as sent by pydcjs.plainFilters, applied to its keys
+	mask=np.zeros(len(keys[0]),dtype=bool)
+	exact=[]
+	for f in filters:
+		if isinstance(f,dict) and 'range' in f:
+			lo,hi=f['range']
+			mask|=((keys[0]>=lo)&(keys[0]<hi)).values
+		elif isinstance(f,dict) and 'range2d' in f:
+			(x0,y0),(x1,y1)=f['range2d']
+			mask|=((keys[0]>=x0)&(keys[0]<x1)&(keys[1]>=y0)&(keys[1]<y1)).values
+		else:
+			f=f if isinstance(f,list) else [f]
+			if labels is not None:
+				# dictionary-encoded columns are filtered by code
+				f=[v if table is None else table[v] for v,table in zip(f,labels)]
+			exact.append(tuple(f))
+	if exact and len(keys)==1:
+		mask|=keys[0].isin([k[0] for k in exact]).values
+	elif exact:
+		mask|=pd.MultiIndex.from_arrays(keys).isin(exact)
+	return mask
+
+def _mask(state,df,exclude=None):
+	# rows passing the filters of every chart (but exclude); the last few
+	# masks are kept by filter state until the rows change
+	cache=state['masks']
+	if cache['df'] is not df:
+		cache['df']=df
+		cache['masks']={}
+		state['keys']={}
+	filters=dict((anchor,f) for anchor,f in state['filters'].items() if anchor in state['charts'] and anchor!=exclude)
+	key=json.dumps(filters,sort_keys=True)
+	if key not in cache['masks']:
+		mask=np.ones(len(df),dtype=bool)
+		for anchor,f in filters.items():
+			mask&=_chart_mask(_keys(state,anchor,df),state['charts'][anchor]['labels'],f)
+		if len(cache['masks'])>=8:
+			cache['masks'].pop(next(iter(cache['masks'])))
+		cache['masks'][key]=mask
+	return cache['masks'][key]
+
+def get_filtered(data=None):
+	# rows of a frame selected by the filters of its charts on the page
+	state=_current if data is None else _datasets.get(data)
+	if state is None or state['df'] is None:
+		raise ValueError('call set_df() before get_filtered()')
+	df=_df(state)
+	if state['engine'] is not None:
+		mask=state['engine'].selected()
+	else:
+		mask=_mask(state,df)
+	rows=df[mask]
+	# undo the reset_index of set_df
+	rows=rows.set_index(list(rows.columns[:len(state['index'])]))
+	rows.index.names=state['index']
+	return rows
+
+def dispose(name='default'):
+	# release a frame on the page (its charts, dimensions and rows) and in the kernel
+	global _current
+	state=_datasets.pop(name,None)
+	if state is not None:
+		_cache['frames'].pop(state['hash'],None)
+		if _current is state:
+			_current=_state(name)
+	display(Javascript("""require(['d3', 'crossfilter', 'dc'], function(d3, crossfilter, dc) {
+	pydcjs.dispose({name}, false);
+	})""".replace('{name}',json.dumps(name))))
+
+def _gzip_b64(text):
+	z=zlib.compressobj(9,zlib.DEFLATED,31)
+	return base64.b64encode(z.compress(text.encode('utf-8'))+z.flush()).decode('ascii')
+
+_export_html="""<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+<style>{css}</style>
+</head>
+<body>
+{divs}
+<script>{d3}</script>
+<script>{crossfilter}</script>
+<script>{dc}</script>
+<script>
+// the require() calls of the chart scripts, without require.js
+window.require = function(deps, callback) {
+	var modules = {d3: d3, crossfilter: crossfilter, dc: dc};
+	if (typeof deps === 'string') {
+		return modules[deps];
+	}
+	callback.apply(null, deps.map(function(name) { return modules[name]; }));
+};
+</script>
+<script>{runtime}</script>
+<script>
+Promise.all([pydcjs.gunzip('{data}'), pydcjs.gunzip('{charts}')]).then(function(texts) {
+	var payload = JSON.parse(texts[0]);
+	var cfdata = {columnar} ? pydcjs.fromColumns(payload) : pydcjs.records(payload);
+	pydcjs.setFrame({name}, cfdata, crossfilter(cfdata));
+	new Function('d3', 'crossfilter', 'dc', texts[1])(d3, crossfilter, dc);
+});
+</script>
+</body>
+</html>
+"""
+
+def export_html(path,data=None,title='pydcjs'):
+	# one HTML file for a frame and the charts drawn from it, that opens
+	# without network or kernel: d3, crossfilter, dc.js and the runtime are
+	# inlined, the rows and chart scripts embedded gzip-compressed
+	state=_current if data is None else _datasets.get(data)
+	if state is None or state['df'] is None:
+		raise ValueError('call set_df() before export_html()')
+	if state['engine'] is not None or state['worker']:
+		raise ValueError("export_html needs the rows on the page; call set_df(df) with engine='browser'")
+	dc_js=_dc_js()
+	payload,labels=_payload(_df(state),state['columnar'],state['precision'],literal=False)
+	charts=_configure_js()+''.join("""
+	(function() {"""+chart.replace('{render}','').replace('{render_all}','')+"""})();
+""" for chart in state['scripts'].values())+"""
+	dc.renderAll();
+	"""
+	script=lambda js:js.replace('</script','<\\/script')
+	html=_export_html\
+	.replace('{title}',title)\
+	.replace('{divs}',''.join("""<div id="chart_{num}"></div>\n""".format(num=figure) for figure in state['scripts']))\
+	.replace('{name}',json.dumps(state['name']))\
+	.replace('{columnar}',json.dumps(state['columnar']))\
+	.replace('{data}',_gzip_b64(payload))\
+	.replace('{charts}',_gzip_b64(charts))\
+	.replace('{css}',_asset('dc.min.css'))\
+	.replace('{runtime}',script(_runtime_js()))\
+	.replace('{d3}',script(_asset('d3.min.js')))\
+	.replace('{crossfilter}',script(_asset('crossfilter.min.js')))\
+	.replace('{dc}',script(dc_js))
+	with io.open(path,'w',encoding='utf-8') as f:
+		f.write(html)
+	return len(html)
+
+def _label_codes(s,labels):
+	# codes against the label table already on the page; unseen labels are appended
+	codes,uniques=pd.factorize(s)
+	keys=dict((json.dumps(label),i) for i,label in enumerate(labels))
+	mapping=[]
+	for value in json.loads(pd.Series(list(uniques),dtype=object).to_json(orient='values'))+[None]:
+		key=json.dumps(value)
+		if key not in keys:
+			keys[key]=len(labels)
+			labels.append(value)
+		mapping.append(keys[key])
+	codes=np.asarray(mapping)[codes]
+	return pd.Series(codes.astype('uint8' if len(labels)<=256 else 'uint16' if len(labels)<=65536 else 'int32'))
+
+def _batch_json(rows,state=None,literal=True):
+	# rows added to the page's crossfilter (append_df, chunked set_df), with the
+	# bin and pack columns of the charts already drawn
+	state=_current if state is None else state
+	batch=rows.assign(**dict((name,derive(rows)) for name,derive in state['derived'].items()))
+	if not state['columnar']:
+		return _records_json(batch,state['precision'],literal)
+	columns=[]
+	for c in batch.columns:
+		labels=state['labels'].get(str(c))
+		s=batch[c] if labels is None else _label_codes(batch[c],labels)
+		columns.append(dict(name=str(c),**_encode_column(s,_precision(state['precision'],c))))
+	return json.dumps({'n':len(batch),'columns':columns,'labels':state['labels']},separators=(',',':'))
+
+@_keeps_current
+def _append_js(df,window,data):
+	_use(data)
+	if _current['df'] is None:
+		raise ValueError('call set_df() before append_df()')
+	_browser_only('append_df')
+	rows=df.reset_index()
+	payload=_batch_json(rows)
+	# the page's crossfilter no longer matches any cached frame
+	_cache['frames'].pop(_current['hash'],None)
+	_current['hash']=None
+	_current['pending'].append(rows)
+	_current['rows']+=len(df)
+	if window is not None:
+		_current['rows']=min(_current['rows'],window)
+	if sum(map(len,_current['pending']))>_current['rows']:
+		_df()
+	return """require(['d3', 'crossfilter', 'dc'], function(d3, crossfilter, dc) {{frame}
+	pydcjs.append(cf, cfdata, {payload}, {window});
+	})""".replace('{frame}',_frame_js(_current))\
+	.replace('{window}',json.dumps(window))\
+	.replace('{payload}',payload)
+
+def append_df(df,window=None,data=None):
+	# add rows to the crossfilter built by set_df and redraw the charts once;
+	# with window=n only the newest n rows are kept
+	display(Javascript(_append_js(df,window,data)))
+
+def stream(frames,window=None,data=None):
+	# append_df for each frame of an iterator, reusing one output for the script
+	handle=None
+	rows=0
+	for df in frames:
+		js=Javascript(_append_js(df,window,data))
+		if handle is None:
+			handle=display(js,display_id=True)
+		else:
+			handle.update(js)
+		rows+=len(df)
+	return rows
+
+def _bin_edges(values,bins=20,binning='width'):
+	values=values[np.isfinite(values)]
+	if not np.isscalar(bins):
+		return np.unique(np.asarray(bins,dtype='float64'))
+	if binning=='quantile':
+		return np.unique(np.quantile(values,np.linspace(0,1,bins+1)))
+	if binning=='width':
+		return np.histogram_bin_edges(values,bins=bins)
+	raise ValueError("binning must be 'width' or 'quantile', not %r"%(binning,))
+
+def _bin_index(values,edges):
+	nbins=len(edges)-1
+	idx=np.digitize(values,edges[1:-1])
+	# NaN and values outside explicit edges get the key Infinity
+	idx[~((values>=edges[0])&(values<=edges[-1]))]=nbins
+	return idx.astype('uint8' if nbins<255 else 'uint16' if nbins<65535 else 'int32')
+
+def _binned(figure,dim,bins,binning,centered):
+	# ship per-row bin indices and group on the bin key instead of raw values
+	if _current['df'] is None:
+		raise ValueError('call set_df() before binning a chart')
+	values=_numbers(_df()[dim])
+	edges=_bin_edges(values,bins,binning)
+	nbins=len(edges)-1
+	idx=_bin_index(values,edges)
+	# same column, edges and keys (centres or left edges) -> same bin column,
+	# so charts can share the dimension and its keys
+	name='{dim}__bin_{k}{h}'.format(dim=dim,k='c' if centered else 'l'\
+		,h=hashlib.sha1(edges.tobytes()).hexdigest()[:8])
+	keys=(edges[:-1]+edges[1:])/2. if centered else edges[:-1]
+	binned={'name':name,'key':"keys[d['%s']]"%name,'values':np.append(keys,np.inf)[idx]\
+			,'x_min':edges[0],'x_max':edges[-1]\
+			,'xunits':'.xUnits(function(){return %d;})'%nbins\
+			,'rows':lambda df:[np.append(keys,np.inf)[_bin_index(_numbers(df[dim]),edges)]]}
+	if _current['engine'] is not None:
+		binned['prepare']=''
+		return binned
+	if _current['worker']:
+		# the bin column and its keys are added to the worker's rows
+		binned['key']="bins['%s'][d['%s']]"%(name,name)
+		binned['prepare']="""
+	pydcjs.workerColumn(frame.worker, '{name}', {col}, [{keys},Infinity]);
+	""".replace('{name}',name)\
+		.replace('{col}',json.dumps(_encode_column(pd.Series(idx))))\
+		.replace('{keys}',','.join(repr(float(k)) for k in keys))
+		return binned
+	# rows pushed later by append_df get their bin index from the same edges
+	_current['derived'][name]=lambda df:_bin_index(_numbers(df[dim]),edges)
+	binned['prepare']="""
+	pydcjs.addColumn(cfdata, '{name}', {col});
+	var keys = [{keys},Infinity];
+	""".replace('{name}',name)\
+	.replace('{col}',json.dumps(_encode_column(pd.Series(idx))))\
+	.replace('{keys}',','.join(repr(float(k)) for k in keys))
+	return binned
+
+def _x_axis(dim,xlim,xscale='linear'):
+	# datetime columns are epoch ms on the page: a d3 time scale over the
+	# data unless xlim is given, and bars sized by the distinct timestamps
+	axis={'scale':'d3.scale.%s()'%xscale,'x_min':_epoch_ms(xlim[0]),'x_max':_epoch_ms(xlim[1]),'xunits':''}
+	df=_current['df']
+	if df is None or dim not in df.columns or df[dim].dtype.kind!='M':
+		return axis
+	values=_numbers(_df()[dim])
+	values=np.unique(values[np.isfinite(values)])
+	axis['scale']='d3.time.scale()'
+	if list(xlim)==[0,100] and len(values):
+		axis['x_min'],axis['x_max']=int(values[0]),int(values[-1])
+	axis['xunits']='.xUnits(function(){return %d;})'%max(1,len(values))
+	return axis
+
+def _packed(columns,resolution):
+	# Composite keys packed into one number (mixed radix over per-column codes),
+	# so crossfilter sorts numbers instead of arrays coerced to strings. Columns
+	# with more than `resolution` distinct numeric values are quantized.
+	if _current['df'] is None:
+		raise ValueError('call set_df() before packing chart keys')
+	df=_df()
+	encoders=[]
+	tables=[]
+	for col in columns:
+		values=df[col]
+		table=pd.factorize(values,sort=True)[1]
+		if values.dtype.kind in 'fiu' and len(table)>resolution:
+			v=values.values.astype('float64')
+			edges=np.linspace(np.nanmin(v),np.nanmax(v),resolution+1)
+			encoders.append(lambda s,edges=edges:np.where(np.isnan(s.values.astype('float64')),-1\
+							,np.digitize(s.values.astype('float64'),edges[1:-1])))
+			table=(edges[:-1]+edges[1:])/2.
+		else:
+			encoders.append(lambda s,table=pd.Index(table):table.get_indexer(s))
+		tables.append(json.loads(pd.Series(list(table)+[None],dtype=object).to_json(orient='values')))
+	def pack(df):
+		# mixed radix over the codes; values outside the tables get the None entry
+		packed=np.zeros(len(df),dtype='int64')
+		for col,encode,table in zip(columns,encoders,tables):
+			codes=encode(df[col])
+			packed=packed*len(table)+np.where(codes<0,len(table)-1,codes)
+		return packed
+	def rows(df):
+		# the unpacked keys of every row, as dc.js sees them
+		keys=[]
+		for col,encode,table in zip(columns,encoders,tables):
+			codes=encode(df[col])
+			values=pd.Series(table,dtype=object)
+			numeric=pd.to_numeric(values,errors='coerce')
+			values=numeric if numeric.notna().sum()==len(table)-1 else values
+			keys.append(values.values[np.where(codes<0,len(table)-1,codes)])
+		return keys
+	packed=pack(df)
+	name='{cols}__pack_{h}'.format(cols='|'.join(map(str,columns))\
+			,h=hashlib.sha1(packed.tobytes()).hexdigest()[:8])
+	_current['derived'][name]=pack
+	prepare="""
+	pydcjs.addColumn(cfdata, '{name}', {col});
+	var pk = pydcjs.packed({tables});
+	""".replace('{name}',name)\
+	.replace('{col}',json.dumps(_encode_column(pd.Series(packed))))\
+	.replace('{tables}',json.dumps(tables))
+	return {'prepare':prepare,'key':"d['%s']"%name,'rows':rows}
+
+def _pack_source(figure,src):
+	# dc.js still sees [x, y(, z)] keys and 2D filters; only the dimension is packed
+	src['gp_js']='pydcjs.unpackedGroup(%s, pk)'%src['gp_js']
+	src['post']+='chart_%s_obj.filterHandler(pydcjs.packedFilterHandler(pk));'%figure
+	return src
+
+def _use_canvas(canvas,columns):
+	# canvas=None: decide from the number of distinct points the chart will draw
+	if canvas is not None:
+		return bool(canvas)
+	if _current['df'] is None or _current['rows']<=config['canvas_threshold']:
+		return False
+	df=_df()
+	if len(df)<=config['canvas_threshold']:
+		return False
+	return len(df[columns].drop_duplicates())>config['canvas_threshold']
+
+_canvas_chart="""
+	d3.select("#chart_{figure}").append("p").text("{title}");
+	{prepare}
+	var dim = {dim_js};
+	{colors}
+	var gp = {gp_js};
+	var chart_{figure}_obj = pydcjs.canvasChart('#chart_{figure}', {options});
+	chart_{figure}_obj
+		.width({width})
+		.height({height})
+		.dimension(dim)
+		.group(gp)
+		{render};
+	{post}
+	"""
+
+def _browser_only(name):
+	if _current['engine'] is not None or _current['worker']:
+		raise ValueError(name+" needs the rows on the page; call set_df(df) with engine='browser'")
+
+_reducers=('count','sum','mean','min','max','distinct')
+
+def _reduce(group,reduce,default='sum'):
+	# (reducer, value column) of a chart: group='Count' counts rows, a column
+	# is reduced with reduce, one of _reducers (pydcjs.reduce on the page)
+	if group=='Count' and reduce in (None,'count'):
+		return 'count',None
+	reduce=default if reduce is None else reduce
+	if reduce not in _reducers:
+		raise ValueError('reduce must be one of %s, not %r'%(', '.join(_reducers),reduce))
+	if group=='Count':
+		raise ValueError('reduce=%r needs a column as group'%(reduce,))
+	return reduce,(None if reduce=='count' else group)
+
+def _reduce_js(reduce,value):
+	if reduce=='count':
+		return 'dim.group().reduceCount()'
+	return """pydcjs.reduce(dim.group(), '%s', function(v) {
+	return v.%s;
+	})"""%(reduce,value)
+
+def _source(figure,key,columns,gp_js,reduce='count',value=None,values=None,rows=None):
+	# browser crossfilter, or the kernel-side engine after set_df(engine='python')
+	# rows: the columns the dimension keys are made of (default: columns), or
+	# a function of the frame returning the keys, for get_filtered
+	if rows is None and columns is not None:
+		rows=[columns] if isinstance(columns,str) else list(columns)
+	anchor='chart_%s'%figure
+	# label tables of the dictionary-encoded key columns, see _axis_labels
+	key_labels=[] if rows is None or callable(rows)\
+		else ["cfdata.labels['%s']"%c if str(c) in _current['labels'] else None for c in rows]
+	if rows is not None:
+		_current['charts'][anchor]={'rows':rows\
+			,'labels':None if callable(rows) else [_current['labels'].get(str(c)) for c in rows]}
+		_current['filters'].pop(anchor,None)
+		_current['keys'].pop(anchor,None)
+		_current['series'].pop(anchor,None)
+		_current['top'].pop(anchor,None)
+		_current['masks']['masks']={}
+	engine=_current['engine']
+	if _current['worker']:
+		# dimensions and groups are built in the worker from the same expressions
+		src={'dim_js':"pydcjs.workerDimension(frame.worker, '#chart_%s', %s)"%(figure,json.dumps(key))\
+			,'gp_js':'pydcjs.workerGroup(dim, %s)'%json.dumps(gp_js)\
+			,'post':'chart_%s_obj.filterHandler(pydcjs.workerFilterHandler);'%figure\
+			,'key_label':'d.key','labels':key_labels}
+		if isinstance(columns,str) and columns in _current['labels']:
+			labels="cfdata.labels['%s']"%columns
+			src['key_label']='pydcjs.keyLabel(%s, d.key)'%labels
+			src['post']+='pydcjs.labelLegend(chart_%s_obj, %s);'%(figure,labels)
+		return src
+	if engine is None:
+		# charts share dimensions and groups through the pydcjs registry
+		src={'dim_js':"pydcjs.dimension(cf, '#chart_%s', %s, function(d) {\n\treturn %s;\n\t})"%(figure,json.dumps(key),key)\
+			,'gp_js':'pydcjs.group(dim, %s, function(dim) {\n\treturn %s;\n\t})'%(json.dumps(gp_js),gp_js)\
+			,'post':'','key_label':'d.key','labels':key_labels}
+		if isinstance(columns,str) and columns in _current['labels']:
+			# dictionary-encoded column: keys are codes, show the labels
+			labels="cfdata.labels['%s']"%columns
+			src['key_label']='pydcjs.keyLabel(%s, d.key)'%labels
+			src['post']='pydcjs.labelLegend(chart_%s_obj, %s);'%(figure,labels)
+		return src
+	# the chart drawn before at this anchor gives its dimension back, with
+	# its filter and its bit
+	previous=_current['remote'].pop(anchor,None)
+	if previous is not None:
+		previous.dispose()
+	dimension=_current['remote'][anchor]=engine.dimension(columns,values)
+	group=dimension.group(reduce,value)
+	# ids carry the frame name, see _remote_filter
+	prefix=_current['name']+':'
+	return {'dim_js':"pydcjs.remoteDimension(%s)"%json.dumps(prefix+dimension.id)\
+			,'gp_js':"pydcjs.remoteGroup(%s, %s)"%(json.dumps(prefix+group.id),json.dumps(group.all()))\
+			,'post':'chart_%s_obj.filterHandler(pydcjs.remoteFilterHandler);'%figure\
+			,'key_label':'d.key','labels':key_labels}
+
+def _axis_labels(figure,src,calls):
+	# keys of dictionary-encoded columns are codes on the page; each call
+	# (an axis tickFormat, heatmap colsLabel...) shows their labels instead
+	return ''.join('chart_%s_obj.%s(function(k) { return pydcjs.keyLabel(%s, k); });'%(figure,call,labels)\
+				for call,labels in zip(calls,src['labels']) if labels is not None)
+
+def _key_part(src,i):
+	# d.key[i] of a composite key, as its label for an encoded column
+	labels=src['labels'][i] if i<len(src['labels']) else None
+	return 'd.key[%d]'%i if labels is None else 'pydcjs.keyLabel(%s, d.key[%d])'%(labels,i)
+
+def _top_keys(state,spec,level):
+	# the first k keys by count (or by the sum of column by) among the rows
+	# whose keys the levels above do not show
+	df=_df(state)
+	keys=df[spec['dim']]
+	above=[key for top in spec['levels'][:level] for key in top]
+	if above:
+		rest=~keys.isin(above).values
+		df,keys=df[rest],keys[rest]
+	if spec['by'] is None:
+		rank=keys.value_counts(dropna=False)
+	else:
+		rank=df[spec['by']].groupby(keys,dropna=False).sum().sort_values(ascending=False,kind='mergesort')
+	return list(rank.index[:spec['k']])
+
+def _top_codes(spec,level):
+	# per-row codes of one level: the position among its keys, len(keys) for
+	# Others and, below the first level, len(keys)+1 for keys shown above
+	top=spec['levels'][level]
+	above=[key for keys in spec['levels'][:level] for key in keys]
+	size=len(top)+(2 if level else 1)
+	dtype='uint8' if size<=256 else 'uint16' if size<=65536 else 'int32'
+	def codes(df):
+		keys=df[spec['dim']]
+		c=pd.Index(top).get_indexer(keys)
+		c=np.where(c<0,len(top),c)
+		if above:
+			c[keys.isin(above).values]=len(top)+1
+		return c.astype(dtype)
+	return codes
+
+def _top_labels(spec,level):
+	top=spec['levels'][level]
+	return json.loads(pd.Series(top,dtype=object).to_json(orient='values'))+['Others']+(['(back)'] if level else [])
+
+def _top_name(spec,level):
+	return '{dim}__top{level}_{h}'.format(dim=spec['dim'],level=level\
+			,h=hashlib.sha1(json.dumps([spec['by'],_top_labels(spec,level)]).encode('utf-8')).hexdigest()[:8])
+
+def _top_source(figure,dim,top,by,reduce='count',value=None):
+	# pie/row chart over the top keys of dim and one Others code, so the page
+	# groups k+1 codes instead of every distinct value
+	if _current['df'] is None:
+		raise ValueError('call set_df() before a top-K chart')
+	anchor='chart_%s'%figure
+	spec={'dim':dim,'k':int(top),'by':by,'levels':[],'names':[]}
+	spec['levels'].append(_top_keys(_current,spec,0))
+	spec['names'].append(_top_name(spec,0))
+	name=spec['names'][0]
+	codes=_top_codes(spec,0)
+	values=codes(_df())
+	src=_source(figure,"d['%s']"%name,name,_reduce_js(reduce,value),reduce,value,values=values,rows=lambda df:[codes(df)])
+	_current['top'][anchor]=spec
+	col=json.dumps(_encode_column(pd.Series(values)))
+	if _current['engine'] is not None:
+		prepare=''
+	elif _current['worker']:
+		prepare="pydcjs.workerColumn(frame.worker, '%s', %s, []);"%(name,col)
+	else:
+		_current['derived'][name]=codes
+		_listen('drill',_drill)
+		prepare="pydcjs.addColumn(cfdata, '%s', %s);"%(name,col)
+		src['post']+='pydcjs.topK(chart_%s_obj, frame, %s, top, %s, %d, function(dim) {\n\treturn %s;\n\t});'\
+			%(figure,json.dumps(anchor),json.dumps(name),len(spec['levels'][0]),_reduce_js(reduce,value))
+	src['prepare']=prepare+'\n\tvar top = %s;'%json.dumps(_top_labels(spec,0))
+	src['key_label']='pydcjs.keyLabel(top, d.key)'
+	src['post']+='pydcjs.labelLegend(chart_%s_obj, top);'%figure
+	return src
+
+def _drill(data):
+	# {'frame', 'anchor', 'level'} sent by pydcjs.topK: one level down sends
+	# the codes of the rows in the Others of the level above, going back up
+	# only drops levels
+	state=_datasets.get(data['frame'])
+	spec=None if state is None else state['top'].get(data['anchor'])
+	level=data['level']
+	if spec is None or not 0<=level<=len(spec['levels']):
+		return None
+	for name in spec['names'][level+1:]:
+		state['derived'].pop(name,None)
+	del spec['levels'][level+1:]
+	del spec['names'][level+1:]
+	reply=None
+	if level==len(spec['levels']):
+		df=_df(state)
+		others=_top_codes(spec,level-1)(df)==len(spec['levels'][level-1])
+		spec['levels'].append(_top_keys(state,spec,level))
+		spec['names'].append(_top_name(spec,level))
+		codes=_top_codes(spec,level)
+		state['derived'][spec['names'][level]]=codes
+		reply={'type':'drill','anchor':data['anchor'],'level':level,'name':spec['names'][level]\
+			,'labels':_top_labels(spec,level),'others':len(spec['levels'][level])\
+			,'codes':_encode_column(pd.Series(codes(df[others])))}
+	codes=_top_codes(spec,level)
+	state['charts'][data['anchor']]['rows']=lambda df:[codes(df)]
+	state['filters'].pop(data['anchor'],None)
+	state['keys'].pop(data['anchor'],None)
+	state['masks']['masks']={}
+	return reply
+
+@_keeps_current
 def pieChart(figure=1,make_fig=False,width=200,height=200,dim='',group='Count'\
-			,cx=100,cy=100,innerRadius=10,slicesCap=5,transitionDuration=500,radius=100):
-	begin="""require(['d3', 'crossfilter', 'dc'], function(d3, crossfilter, dc) {"""
-	end="""})"""
+			,cx=100,cy=100,innerRadius=10,slicesCap=5,transitionDuration=500,radius=100,top=None,by=None,reduce=None,data=None):
+	# top=k: the k most frequent keys (or largest sums of column by) and
+	# Others, which is split into the next k keys when clicked
+	# reduce: how a group column is aggregated, one of _reducers (default sum)
+	_use(data)
+	reduce,value=_reduce(group,reduce)
 	#print(js.replace('{data}',df.reset_index().to_json(orient='records')))
 	#print(js)
-	if make_fig:
-		html="""<div id="chart_{num}"></div>""".format(num=figure)
-		display(HTML(html))
 	chart="""
 	d3.select("#chart_{figure}").append("p").text("pieCart: {dim}");
-	var dim = cf.dimension(function(d) {
-	return d.{dim};
-	});
-	var gp = dim.group().reduceCount();
+	{prepare}
+	var dim = {dim_js};
+	var gp = {gp_js};
 	var chart_{figure}_obj = dc.pieChart('#chart_{figure}');
 	chart_{figure}_obj
 		.width({width})
@@ -108,18 +1287,29 @@ def pieChart(figure=1,make_fig=False,width=200,height=200,dim='',group='Count'\
 		.cy({cy})
 		.innerRadius({innerRadius})
 		.slicesCap({slicesCap})
-		.transitionDuration(500)
+		.transitionDuration({transitionDuration})
+		.valueAccessor(function(d) {
+		return pydcjs.value(d.value);
+		})
 		.ordering(function(t){
-		return -t.value;
+		return -pydcjs.value(t.value);
 		})
 		.legend(dc.legend())
 		.label(function(d) {
-		return d.key + ': ' + d.value;
+		return {key_label} + ': ' + pydcjs.value(d.value);
 		})
-		.render();
+		{render};
+	{post}
 	"""
-	display(Javascript(begin\
-	+chart\
+	if top is None:
+		src=_source(figure,'d.'+str(dim),dim,_reduce_js(reduce,value),reduce,value)
+		src['prepare']=''
+	else:
+		src=_top_source(figure,dim,top,by,reduce,value)
+		# dc.js would fold the smallest of the k keys into a second Others
+		slicesCap=max(slicesCap,int(top)+2)
+	_emit(figure,chart\
+	.replace('{prepare}',src['prepare'])\
 	.replace('{figure}',str(figure))\
 	.replace('{dim}',str(dim))\
 	.replace('{width}',str(width))\
@@ -130,35 +1320,110 @@ def pieChart(figure=1,make_fig=False,width=200,height=200,dim='',group='Count'\
 	.replace('{innerRadius}',str(innerRadius))\
 	.replace('{slicesCap}',str(slicesCap))\
 	.replace('{transitionDuration}',str(transitionDuration))\
-	+end))
+	.replace('{key_label}',src['key_label'])\
+	.replace('{post}',src['post'])\
+	.replace('{dim_js}',src['dim_js'])\
+	.replace('{gp_js}',src['gp_js'])\
+	,make_fig)
 
-def boxplot(figure=1,make_fig=False,width=200,height=200,dim='',group=''\
-			,boxwidth=30,transitionDuration=500):
+def _emit(figure,chart,make_fig=False):
+	# display one chart now, or hand it to the Dashboard being built
+	_listen('filters',_sync)
+	chart=_frame_js(_current,'#chart_%s'%figure)+chart\
+		+'\n\tpydcjs.syncFilters(chart_%s_obj, frame);\n'%figure
+	# the last chart drawn at each anchor, for export_html
+	for state in _datasets.values():
+		state['scripts'].pop(figure,None)
+	_current['scripts'][figure]=chart
+	dashboard=_layout['dashboard']
+	if dashboard is not None:
+		dashboard.charts.append((figure,chart))
+		return
+	if make_fig:
+		html="""<div id="chart_{num}"></div>""".format(num=figure)
+		display(HTML(html))
 	begin="""require(['d3', 'crossfilter', 'dc'], function(d3, crossfilter, dc) {"""
 	end="""})"""
+	display(Javascript(begin\
+	+_configure_js()\
+	+chart\
+	.replace('{render}','.render()')\
+	.replace('{render_all}','pydcjs.renderAll();')\
+	+end))
+
+class Dashboard(object):
+	# Chart functions called inside "with Dashboard():" are collected instead
+	# of displayed; on exit the layout divs and one script are emitted, with a
+	# single require() and a single dc.renderAll().
+	def __init__(self,n=None):
+		self.n=n
+		self.charts=[]
+
+	def __enter__(self):
+		self._previous=_layout['dashboard']
+		_layout['dashboard']=self
+		return self
+
+	def __exit__(self,type,value,traceback):
+		_layout['dashboard']=self._previous
+		if type is None:
+			self.show()
+
+	def html(self):
+		figures=list(range(1,self.n+1)) if self.n is not None else []
+		for figure,chart in self.charts:
+			if figure not in figures:
+				figures.append(figure)
+		return ''.join("""<div id="chart_{num}"></div>""".format(num=figure) for figure in figures)
+
+	def js(self):
+		begin="""require(['d3', 'crossfilter', 'dc'], function(d3, crossfilter, dc) {"""
+		end="""})"""
+		# each chart in its own scope: templates reuse names like dim, gp, keys
+		body=''.join("""
+	(function() {"""+chart.replace('{render}','').replace('{render_all}','')+"""})();
+""" for figure,chart in self.charts)
+		return begin+_configure_js()+body+"""
+	dc.renderAll();
+	"""+end
+
+	def show(self):
+		display(HTML(self.html()))
+		display(Javascript(self.js()))
+
+_boxplot_reduce="""pydcjs.boxReducer(dim.group(), function(v) {
+	return v.{group};
+	})"""
+
+def _box_summary(df,dim,group):
+	# quartiles and Tukey whiskers per key, the same numbers d3.box derives
+	rows=[]
+	for key,values in df.groupby(dim,sort=True)[group]:
+		values=values.dropna().values
+		if not len(values):
+			continue
+		q1,med,q3=np.percentile(values,[25,50,75])
+		iqr=q3-q1
+		lo=values[values>=q1-1.5*iqr].min()
+		hi=values[values<=q3+1.5*iqr].max()
+		rows.append({'key':key.item() if isinstance(key,np.generic) else key\
+					,'value':[float(lo),float(q1),float(med),float(q3),float(hi)]})
+	return rows
+
+@_keeps_current
+def boxplot(figure=1,make_fig=False,width=200,height=200,dim='',group=''\
+			,boxwidth=30,transitionDuration=500,backend='histogram',data=None):
+	_use(data)
+	# histogram: per-key value counts, O(1) add/remove while other charts filter
+	# static: quartiles computed in Python, not updated by filters
+	if _current['engine'] is not None:
+		backend='static'
 	#print(js.replace('{data}',df.reset_index().to_json(orient='records')))
 	#print(js)
-	if make_fig:
-		html="""<div id="chart_{num}"></div>""".format(num=figure)
-		display(HTML(html))
 	chart="""
 	d3.select("#chart_{figure}").append("p").text("boxplot: {dim}");
-	var dim = cf.dimension(function(d) {
-	return d.{dim};
-	});
-	var gp= dim.group().reduce(
-			  function(p,v) {
-			    p.push(v.{group});
-			    return p;
-			  },
-			  function(p,v) {
-			    p.splice(p.indexOf(v.{group}), 1);
-			    return p;
-			  },
-			  function() {
-			    return [];
-			  }
-			);
+	var dim = {dim_js};
+	var gp = {gp_js};
 
 	var chart_{figure}_obj = dc.boxPlot('#chart_{figure}');
 	chart_{figure}_obj
@@ -167,47 +1432,69 @@ def boxplot(figure=1,make_fig=False,width=200,height=200,dim='',group=''\
 		.dimension(dim)
 		.group(gp)
 		.boxWidth({boxwidth})
-		.transitionDuration(500)
+		.valueAccessor({value_accessor})
+		.transitionDuration({transitionDuration})
 		.elasticY(true)
 		.ordering(function(t){
 		return -t.value;
 		})
 		.legend(dc.legend())
 		.label(function(d) {
-		return d.key + ': ' + d.value;
+		return {key_label} + ': ' + d.value;
 		})
-		.render();
+		{render};
+	{post}
 	"""
-	display(Javascript(begin\
-	+chart\
+	if backend=='static':
+		src={'dim_js':"pydcjs.remoteDimension('box_%s')"%figure\
+			,'gp_js':"pydcjs.remoteGroup('box_%s', %s)"%(figure,json.dumps(_box_summary(_df(),dim,group)))\
+			,'post':'','key_label':'d.key','labels':[]}
+		value_accessor='function(d) { return d.value; }'
+	elif backend=='histogram':
+		src=_source(figure,'d.'+str(dim),dim,_boxplot_reduce.replace('{group}',str(group)))
+		value_accessor='pydcjs.boxValues'
+	else:
+		raise ValueError("backend must be 'histogram' or 'static', not %r"%(backend,))
+	_emit(figure,chart\
 	.replace('{figure}',str(figure))\
 	.replace('{dim}',str(dim))\
 	.replace('{group}',str(group))\
 	.replace('{width}',str(width))\
 	.replace('{height}',str(height))\
 	.replace('{boxwidth}',str(boxwidth))\
+	.replace('{value_accessor}',value_accessor)\
 	.replace('{transitionDuration}',str(transitionDuration))\
-	+end))
+	.replace('{key_label}',src['key_label'])\
+	.replace('{post}',src['post']+_axis_labels(figure,src,['xAxis().tickFormat']))\
+	.replace('{dim_js}',src['dim_js'])\
+	.replace('{gp_js}',src['gp_js'])\
+	,make_fig)
 
+@_keeps_current
 def barChart(figure=1,make_fig=False,width=200,height=200,dim='',group='Count'\
-			,centerBar='true',xlim=[0,100],ylim=[0,100],gap=10,xticks=5,yticks=5,xlabel=' ',ylabel=' ',elasticX='true',elasticY='true',transitionDuration=500,HorizontalGrid='true',VerticalGrid='true'):
-	x_min=xlim[0]
-	x_max=xlim[1]
+			,centerBar='true',xlim=[0,100],ylim=[0,100],gap=10,xticks=5,yticks=5,xlabel=' ',ylabel=' ',elasticX='true',elasticY='true',transitionDuration=500,HorizontalGrid='true',VerticalGrid='true'\
+			,bins=None,binning='width',reduce=None,data=None):
+	# reduce: see pieChart
+	_use(data)
+	reduce,value=_reduce(group,reduce)
+	axis=_x_axis(dim,xlim)
+	x_min=axis['x_min']
+	x_max=axis['x_max']
 	y_min=ylim[0]
 	y_max=ylim[1]
-	begin="""require(['d3', 'crossfilter', 'dc'], function(d3, crossfilter, dc) {"""
-	end="""})"""
+	binned={'prepare':'','key':'d.'+str(dim),'name':dim,'values':None,'xunits':axis['xunits'],'rows':None}
+	if bins is not None:
+		binned=_binned(figure,dim,bins,binning,centerBar=='true')
+		x_min=binned['x_min']
+		x_max=binned['x_max']
+	src=_source(figure,binned['key'],binned['name'],_reduce_js(reduce,value),reduce,value,values=binned['values'],rows=binned['rows'])
 	#print(js.replace('{data}',df.reset_index().to_json(orient='records')))
 	#print(js)
-	if make_fig:
-		html="""<div id="chart_{num}"></div>""".format(num=figure)
-		display(HTML(html))
 	chart="""
 	d3.select("#chart_{figure}").append("p").text("barCart: {dim}");
-	var dim = cf.dimension(function(d) {
-	return d.{dim};
-	});
-	var gp = dim.group().reduceCount();
+	{prepare}
+	var dim = {dim_js};
+	var gp = {gp_js};
 	var chart_{figure}_obj = dc.barChart('#chart_{figure}');
 	chart_{figure}_obj
 		.width({width})
@@ -216,28 +1503,34 @@ def barChart(figure=1,make_fig=False,width=200,height=200,dim='',group='Count'\
 		.group(gp)
 		.transitionDuration({transitionDuration})
 		.centerBar({centerBar})
+		.valueAccessor(function(d) {
+		return pydcjs.value(d.value);
+		})
 		.gap({gap})
-		.x(d3.scale.linear().domain([{x_min},{x_max}]))
+		.x({xscale}.domain([{x_min},{x_max}])){xunits}
 		.y(d3.scale.linear().domain([{y_min},{y_max}]))
 		.renderHorizontalGridLines({HorizontalGrid})
 		.renderVerticalGridLines({VerticalGrid})
-		.render()
+		{render}
 		.yAxisLabel("{ylabel}")
 		.xAxisLabel("{xlabel}")
 		//.xAxis().ticks({xticks})
 		//.yAxis().ticks({xticks})
 		.elasticY({elasticY});
 		//.elasticX({elasticX});
-	dc.renderAll();
+	{post}
+	{render_all}
 	"""
-	display(Javascript(begin\
-	+chart\
+	_emit(figure,chart\
+	.replace('{prepare}',binned['prepare'])\
+	.replace('{xunits}',binned['xunits'])\
 	.replace('{figure}',str(figure))\
 	.replace('{dim}',str(dim))\
 	.replace('{width}',str(width))\
 	.replace('{height}',str(height))\
 	.replace('{centerBar}',centerBar)\
 	.replace('{gap}',str(gap))\
+	.replace('{xscale}',axis['scale'])\
 	.replace('{x_min}',str(x_min))\
 	.replace('{x_max}',str(x_max))\
 	.replace('{y_min}',str(y_min))\
@@ -251,74 +1544,159 @@ def barChart(figure=1,make_fig=False,width=200,height=200,dim='',group='Count'\
 	#.replace('{elasticX}',elasticX)\
 	.replace('{elasticY}',elasticY)\
 	.replace('{transitionDuration}',str(transitionDuration))\
-	+end))
+	.replace('{post}',src['post']+_axis_labels(figure,src,['xAxis().tickFormat']))\
+	.replace('{dim_js}',src['dim_js'])\
+	.replace('{gp_js}',src['gp_js'])\
+	,make_fig)
+
+_series_how=('count','sum','mean','min','max')
+
+def _resample(x,y,how,lo,hi,points,time):
+	# points buckets of equal width from lo to hi, the last one closed so that
+	# it keeps the rows at hi; whole milliseconds when x is epoch ms
+	if not len(x):
+		return np.zeros(0),np.zeros(0)
+	step=max((hi-lo)/float(points),1. if time else 1e-12)
+	if time:
+		step=float(np.ceil(step))
+	codes=np.minimum(np.floor((x-lo)/step),points-1)
+	agg=getattr(pd.Series(y).groupby(codes),'sum' if how=='count' else how)()
+	# buckets without selected rows count 0, like the groups of other charts
+	agg=agg.reindex(np.arange(points,dtype='float64'),fill_value=0 if how in ('count','sum') else np.nan)
+	keys=lo+agg.index.values*step
+	values=agg.values.astype('float64')
+	# empty buckets have no mean, min or max
+	present=~np.isnan(values)
+	return keys[present],values[present]
+
+def _lttb(x,y,n):
+	# largest-triangle-three-buckets: the first and last points, and from each
+	# of n-2 buckets the point spanning the largest triangle with the point
+	# kept before it and the average of the next bucket
+	if n<3 or len(x)<=n:
+		return x,y
+	edges=np.linspace(1,len(x)-1,n-1).astype('int64')
+	keep=[0]
+	for i in range(n-2):
+		lo,hi=edges[i],edges[i+1]
+		if i+2<len(edges):
+			cx,cy=x[hi:edges[i+2]].mean(),y[hi:edges[i+2]].mean()
+		else:
+			cx,cy=x[-1],y[-1]
+		ax,ay=x[keep[-1]],y[keep[-1]]
+		area=np.abs((ax-cx)*(y[lo:hi]-ay)-(ax-x[lo:hi])*(cy-ay))
+		keep.append(lo+int(np.argmax(area)))
+	keep.append(len(x)-1)
+	return x[keep],y[keep]
 
+def _series(state,anchor):
+	# the line of a time-series lineChart: rows selected by the other charts,
+	# resampled to the point budget over the whole x range, and again at full
+	# budget inside the range brushed on the chart itself
+	spec=state['series'][anchor]
+	df=_df(state)
+	extent=_numbers(df[spec['dim']])
+	extent=extent[np.isfinite(extent)]
+	if not len(extent):
+		return []
+	rows=df[_mask(state,df,exclude=anchor)]
+	x=_numbers(rows[spec['dim']])
+	y=np.ones(len(rows)) if spec['value'] is None else _numbers(rows[spec['value']])
+	finite=np.isfinite(x)
+	x,y=x[finite],y[finite]
+	time=df[spec['dim']].dtype.kind=='M'
+	# with LTTB, resample finer and let the decimation pick the shape
+	budget=spec['points']*4 if spec['lttb'] else spec['points']
+	def line(x,y,lo,hi):
+		keys,values=_resample(x,y,spec['how'],lo,hi,budget,time)
+		if spec['lttb']:
+			keys,values=_lttb(keys,values,spec['points'])
+		return keys,values
+	keys,values=line(x,y,extent.min(),extent.max())
+	brushed=[f['range'] for f in state['filters'].get(anchor,[]) if isinstance(f,dict) and 'range' in f]
+	if len(brushed)==1:
+		lo,hi=brushed[0]
+		inside=(x>=lo)&(x<hi)
+		outside=(keys<lo)|(keys>=hi)
+		fine=line(x[inside],y[inside],lo,hi)
+		keys=np.concatenate([keys[outside],fine[0]])
+		values=np.concatenate([values[outside],fine[1]])
+		order=np.argsort(keys,kind='mergesort')
+		keys,values=keys[order],values[order]
+	return [{'key':float(k),'value':float(v)} for k,v in zip(keys,values)]
+
+@_keeps_current
 def lineChart(figure=1,make_fig=False,width=200,height=200,dim='',group='Count'\
 			,xlim=[0,100],ylim=[0,100],xticks=5,yticks=5,xlabel=' ',ylabel=' '\
 			,elasticX='true',elasticY='true',transitionDuration=500,\
 			HorizontalGrid='true',VerticalGrid='true',renderArea='false'\
-			,xscale='linear',yscale='linear'):
-	x_min=xlim[0]
-	x_max=xlim[1]
+			,xscale='linear',yscale='linear',bins=None,binning='width',points=None,lttb=False,reduce=None,data=None):
+	# reduce: see pieChart
+	# points: time-series mode, the kernel resamples group by dim with reduce
+	# (count, sum, mean, min, max) to about this many points, decimated with
+	# largest-triangle-three-buckets when lttb=True
+	_use(data)
+	_browser_only('lineChart')
+	reduce,value=_reduce(group,reduce)
+	if points is not None and bins is not None:
+		raise ValueError('lineChart takes bins or points, not both')
+	if points is not None and reduce not in _series_how:
+		raise ValueError('a time-series lineChart reduces with one of %s, not %r'%(', '.join(_series_how),reduce))
+	axis=_x_axis(dim,xlim,xscale)
+	x_min=axis['x_min']
+	x_max=axis['x_max']
 	y_min=ylim[0]
 	y_max=ylim[1]
-	begin="""require(['d3', 'crossfilter', 'dc'], function(d3, crossfilter, dc) {"""
-	end="""})"""
+	binned={'prepare':'','key':'d.'+str(dim),'xunits':axis['xunits'],'rows':None}
+	if bins is not None:
+		binned=_binned(figure,dim,bins,binning,True)
+		x_min=binned['x_min']
+		x_max=binned['x_max']
 	#print(js.replace('{data}',df.reset_index().to_json(orient='records')))
 	#print(js)
-	if make_fig:
-		html="""<div id="chart_{num}"></div>""".format(num=figure)
-		display(HTML(html))
-	if group=='Count':
-		gp="""dim.group().reduceCount()"""
-	else:
-		# gp="""dim.group(function (d) {
-		# return d."""+str(group)+""";})"""
-		gp="""dim.group().reduce(
-		function(p, v) {{
-		return v.{GROUP};
-		}},
-		function(p, v) {{
-		return v.{GROUP};
-		}},
-		function() {{
-		return {{}};
-		}})""".format(GROUP=group)
 	chart="""
 	d3.select("#chart_{figure}").append("p").text("lineCart: {dim}");
-	var dim = cf.dimension(function(d) {
-	return d.{dim};
-	});
+	{prepare}
+	var dim = {dim_js};
+	var gp = {gp_js};
 	var chart_{figure}_obj = dc.lineChart('#chart_{figure}');
 	chart_{figure}_obj
 		.width({width})
 		.height({height})
 		.dimension(dim)
-		.group({gp})
+		.group(gp)
+		.valueAccessor(function(d) {
+		return pydcjs.value(d.value);
+		})
 		.transitionDuration({transitionDuration})
-		.x(d3.scale.{xscale}().domain([{x_min},{x_max}]))
+		.x({xscale}.domain([{x_min},{x_max}])){xunits}
 		.y(d3.scale.{yscale}().domain([{y_min},{y_max}]))
 		.renderHorizontalGridLines({HorizontalGrid})
 		.renderVerticalGridLines({VerticalGrid})
 		.renderArea({renderArea})
-		.render()
+		{render}
 		.yAxisLabel("{ylabel}")
 		.xAxisLabel("{xlabel}")
 		//.xAxis().ticks({xticks})
 		//.yAxis().ticks({xticks})
 		.elasticY({elasticY});
 		//.elasticX({elasticX});
-	dc.renderAll();
+	{post}
+	{render_all}
 	"""
-
-	display(Javascript(begin\
-	+chart\
+	src=_source(figure,binned['key'],dim,_reduce_js(reduce,value),rows=binned['rows'])
+	if points is not None:
+		anchor='chart_%s'%figure
+		_current['series'][anchor]={'dim':dim,'value':value,'how':reduce,'points':int(points),'lttb':bool(lttb)}
+		src['gp_js']='pydcjs.seriesGroup(%s, %s)'%(json.dumps(anchor),json.dumps(_series(_current,anchor)))
+	_emit(figure,chart\
+	.replace('{prepare}',binned['prepare'])\
+	.replace('{xunits}',binned['xunits'])\
 	.replace('{figure}',str(figure))\
 	.replace('{dim}',str(dim))\
-	.replace('{gp}',str(gp))\
 	.replace('{width}',str(width))\
 	.replace('{height}',str(height))\
-	.replace('{xscale}',str(xscale))\
+	.replace('{xscale}',axis['scale'])\
 	.replace('{yscale}',str(yscale))\
 	.replace('{x_min}',str(x_min))\
 	.replace('{x_max}',str(x_max))\
@@ -334,12 +1712,19 @@ def lineChart(figure=1,make_fig=False,width=200,height=200,dim='',group='Count'\
 	#.replace('{elasticX}',elasticX)\
 	.replace('{elasticY}',elasticY)\
 	.replace('{transitionDuration}',str(transitionDuration))\
-	+end))
+	.replace('{post}',src['post'])\
+	.replace('{dim_js}',src['dim_js'])\
+	.replace('{gp_js}',src['gp_js'])\
+	,make_fig)
 
 
+@_keeps_current
 def scatterPlot(figure=1,make_fig=False,width=200,height=200,dim=['',''],group='Count'\
 			,xlim=[0,100],ylim=[0,100],symbolSize=5,elasticY='true',transitionDuration=500,\
-			HorizontalGrid='true',VerticalGrid='true',xlabel='x',ylabel='y',xscale='linear',yscale='linear'):
+			HorizontalGrid='true',VerticalGrid='true',xlabel='x',ylabel='y',xscale='linear',yscale='linear'\
+			,pack=False,resolution=512,canvas=None,data=None):
+	_use(data)
+	_browser_only('scatterPlot')
 	x_min = xlim[0]
 	x_max = xlim[1]
 	y_min = ylim[0]
@@ -347,19 +1732,13 @@ def scatterPlot(figure=1,make_fig=False,width=200,height=200,dim=['',''],group='
 	dim1  = dim[0]
 	dim2  = dim[1]
 
-	begin="""require(['d3', 'crossfilter', 'dc'], function(d3, crossfilter, dc) {"""
-	end="""})"""
 	#print(js.replace('{data}',df.reset_index().to_json(orient='records')))
 	#print(js)
-	if make_fig:
-		html="""<div id="chart_{num}"></div>""".format(num=figure)
-		display(HTML(html))
 	chart="""
 	d3.select("#chart_{figure}").append("p").text("scatterPlot: {dim1},{dim2}");
-	var dim = cf.dimension(function(d) {
-	return [d.{dim1}, d.{dim2}];
-	});
-	var gp = dim.group().reduceCount();
+	{prepare}
+	var dim = {dim_js};
+	var gp = {gp_js};
 	var chart_{figure}_obj = dc.scatterPlot('#chart_{figure}');
 	chart_{figure}_obj
 		.width({width})
@@ -376,13 +1755,25 @@ def scatterPlot(figure=1,make_fig=False,width=200,height=200,dim=['',''],group='
 		.yAxisLabel("{ylabel}")
 		.symbolSize({symbolSize})
 		//.clipPadding(10)
-		.render()
+		{render}
 		.elasticY({elasticY});
 		//.elasticX({elasticX});
-	dc.renderAll();
+	{post}
+	{render_all}
 	"""
-	display(Javascript(begin\
-	+chart\
+	packed={'prepare':'','key':'[d.%s, d.%s]'%(dim1,dim2),'rows':[dim1,dim2]}
+	if pack:
+		packed=_packed([dim1,dim2],resolution)
+	src=_source(figure,packed['key'],None,'dim.group().reduceCount()',rows=packed['rows'])
+	if pack:
+		src=_pack_source(figure,src)
+	if _use_canvas(canvas,[dim1,dim2]):
+		chart=_canvas_chart\
+		.replace('{title}','scatterPlot: {dim1},{dim2}')\
+		.replace('{colors}','')\
+		.replace('{options}',"{kind: 'scatter', x: [{x_min},{x_max}], y: [{y_min},{y_max}], xscale: '{xscale}', yscale: '{yscale}', symbolSize: {symbolSize}, color: '#1f77b4'}")
+	_emit(figure,chart\
+	.replace('{prepare}',packed['prepare'])\
 	.replace('{figure}',str(figure))\
 	.replace('{dim1}',str(dim1))\
 	.replace('{dim2}',str(dim2))\
@@ -401,11 +1792,19 @@ def scatterPlot(figure=1,make_fig=False,width=200,height=200,dim=['',''],group='
 	.replace('{yscale}',yscale)\
 	.replace('{xscale}',xscale)\
 	.replace('{transitionDuration}',str(transitionDuration))\
-	+end))
+	.replace('{post}',src['post'])\
+	.replace('{dim_js}',src['dim_js'])\
+	.replace('{gp_js}',src['gp_js'])\
+	,make_fig)
 
+@_keeps_current
 def bubbleChart(figure=1,make_fig=False,width=200,height=200,dim=['','',''],group='Count'\
 			,xlim=[0,100],ylim=[0,100],rlim=[1,100],elasticY='true',transitionDuration=500,\
-			HorizontalGrid='true',VerticalGrid='true',xlabel='x',ylabel='y'):
+			HorizontalGrid='true',VerticalGrid='true',xlabel='x',ylabel='y',pack=False,resolution=512,reduce=None,data=None):
+	# reduce: how group sizes the bubbles, see pieChart
+	_use(data)
+	_browser_only('bubbleChart')
+	reduce,value=_reduce(group,reduce)
 	x_min = xlim[0]
 	x_max = xlim[1]
 	y_min = ylim[0]
@@ -416,19 +1815,13 @@ def bubbleChart(figure=1,make_fig=False,width=200,height=200,dim=['','',''],grou
 	dim2  = dim[1]
 	dim3  = dim[2]
 
-	begin="""require(['d3', 'crossfilter', 'dc'], function(d3, crossfilter, dc) {"""
-	end="""})"""
 	#print(js.replace('{data}',df.reset_index().to_json(orient='records')))
 	#print(js)
-	if make_fig:
-		html="""<div id="chart_{num}"></div>""".format(num=figure)
-		display(HTML(html))
 	chart="""
 	d3.select("#chart_{figure}").append("p").text("bubbleChart: {dim1},{dim2},{dim3}");
-	var dim = cf.dimension(function(d) {
-	return [d.{dim1}, d.{dim2}, d.{dim3}];
-	});
-	var gp = dim.group().reduceCount();
+	{prepare}
+	var dim = {dim_js};
+	var gp = {gp_js};
 	var chart_{figure}_obj = dc.bubbleChart('#chart_{figure}');
 	chart_{figure}_obj
 		.width({width})
@@ -438,7 +1831,7 @@ def bubbleChart(figure=1,make_fig=False,width=200,height=200,dim=['','',''],grou
 		.transitionDuration({transitionDuration})
 		.keyAccessor(function(d){return d.key[0];})
 		.valueAccessor(function(d){return d.key[1];})
-		.radiusValueAccessor(function(d){return d.value})
+		.radiusValueAccessor(function(d){return pydcjs.value(d.value)})
 		//.elasticRadius(true)
 		.x(d3.scale.linear().domain([{x_min},{x_max}]))
 		.y(d3.scale.linear().domain([{y_min},{y_max}]))
@@ -450,16 +1843,23 @@ def bubbleChart(figure=1,make_fig=False,width=200,height=200,dim=['','',''],grou
 		.yAxisLabel("{ylabel}")
 		//.clipPadding(10)
 		.label(function(d) {
-		return '('+ d.key[0] + ',' + d.key[1] + ')' + ':' + d.value;
+		return '('+ {key0} + ',' + {key1} + ')' + ':' + pydcjs.value(d.value);
 		//return d.value;
 		})
-		.render()
+		{render}
 		.elasticY({elasticY});
 		//.elasticX({elasticX});
-	dc.renderAll();
+	{post}
+	{render_all}
 	"""
-	display(Javascript(begin\
-	+chart\
+	packed={'prepare':'','key':'[d.%s, d.%s, d.%s]'%(dim1,dim2,dim3),'rows':[dim1,dim2,dim3]}
+	if pack:
+		packed=_packed([dim1,dim2,dim3],resolution)
+	src=_source(figure,packed['key'],None,_reduce_js(reduce,value),rows=packed['rows'])
+	if pack:
+		src=_pack_source(figure,src)
+	_emit(figure,chart\
+	.replace('{prepare}',packed['prepare'])\
 	.replace('{figure}',str(figure))\
 	.replace('{dim1}',str(dim1))\
 	.replace('{dim2}',str(dim2))\
@@ -478,24 +1878,27 @@ def bubbleChart(figure=1,make_fig=False,width=200,height=200,dim=['','',''],grou
 	.replace('{xlabel}',str(xlabel))\
 	.replace('{ylabel}',str(ylabel))\
 	.replace('{transitionDuration}',str(transitionDuration))\
-	+end))
+	.replace('{key0}',_key_part(src,0))\
+	.replace('{key1}',_key_part(src,1))\
+	.replace('{post}',src['post']+_axis_labels(figure,src,['xAxis().tickFormat','yAxis().tickFormat']))\
+	.replace('{dim_js}',src['dim_js'])\
+	.replace('{gp_js}',src['gp_js'])\
+	,make_fig)
 
+@_keeps_current
 def rowChart(figure=1,make_fig=False,width=200,height=200,dim='',group='Count'\
-			,xticks=4,elasticX='true',transitionDuration=500,gap=10):
-	begin="""require(['d3', 'crossfilter', 'dc'], function(d3, crossfilter, dc) {"""
-	end="""})"""
+			,xticks=4,elasticX='true',transitionDuration=500,gap=10,top=None,by=None,reduce=None,data=None):
+	# top, by, reduce: see pieChart
+	_use(data)
+	reduce,value=_reduce(group,reduce)
 	#print(js.replace('{data}',df.reset_index().to_json(orient='records')))
 	#print(js)
-	if make_fig:
-		html="""<div id="chart_{num}"></div>""".format(num=figure)
-		display(HTML(html))
 
 	chart="""
 	d3.select("#chart_{figure}").append("p").text("rowCart: {dim}");
-	var dim = cf.dimension(function(d) {
-	return d.{dim};
-	});
-	var gp = dim.group().reduceCount();
+	{prepare}
+	var dim = {dim_js};
+	var gp = {gp_js};
 	var chart_{figure}_obj = dc.rowChart('#chart_{figure}');
 	chart_{figure}_obj
 		.width({width})
@@ -504,16 +1907,31 @@ def rowChart(figure=1,make_fig=False,width=200,height=200,dim='',group='Count'\
 		.group(gp)
 		.transitionDuration({transitionDuration})
 		.elasticX({elasticX})
+		.valueAccessor(function(d) {
+		return pydcjs.value(d.value);
+		})
 		.legend(dc.legend())
+		.label(function(d) {
+		return {key_label};
+		})
+		.title(function(d) {
+		return {key_label} + ': ' + pydcjs.value(d.value);
+		})
 		//.gap({gap})
 		//.xAxisLabel("{xlabel}")
-		.render()
+		{render}
 		//.yAxisLabel("{ylabel}");
 		//.xAxis().ticks({xticks});
-	dc.renderAll();
+	{post}
+	{render_all}
 	"""
-	display(Javascript(begin\
-	+chart\
+	if top is None:
+		src=_source(figure,'d.'+str(dim),dim,_reduce_js(reduce,value),reduce,value)
+		src['prepare']=''
+	else:
+		src=_top_source(figure,dim,top,by,reduce,value)
+	_emit(figure,chart\
+	.replace('{prepare}',src['prepare'])\
 	.replace('{figure}',str(figure))\
 	.replace('{dim}',str(dim))\
 	.replace('{width}',str(width))\
@@ -524,10 +1942,24 @@ def rowChart(figure=1,make_fig=False,width=200,height=200,dim='',group='Count'\
 	.replace('{elasticX}',elasticX)\
 	.replace('{gap}',str(gap))\
 	.replace('{transitionDuration}',str(transitionDuration))\
-	+end))
+	.replace('{key_label}',src['key_label'])\
+	.replace('{post}',src['post'])\
+	.replace('{dim_js}',src['dim_js'])\
+	.replace('{gp_js}',src['gp_js'])\
+	,make_fig)
+
+_heatmap_colors="""var heatColorMapping = function(d){
+		return d3.scale.linear().domain([{clim1},{clim2}]).range(["{color1}","{color2}"])(d);
+	};
+	heatColorMapping.domain = function(d){
+		return [{clim1},{clim2}];
+	};"""
 
+@_keeps_current
 def heatmap(figure=1,make_fig=False,width=200,height=200,dim=['','',''],group='Count'\
-			,transitionDuration=500,xlabel='x',ylabel='y',clim=[0,100],colormap=['blue','red']):
+			,transitionDuration=500,xlabel='x',ylabel='y',clim=[0,100],colormap=['blue','red'],pack=False,resolution=512,canvas=None,reduce='mean',data=None):
+	# reduce: how the dim[2] column colors a cell, see pieChart
+	_use(data)
 	dim1  = dim[0]
 	dim2  = dim[1]
 	dim3  = dim[2]
@@ -535,40 +1967,12 @@ def heatmap(figure=1,make_fig=False,width=200,height=200,dim=['','',''],group='C
 	clim2 = clim[1]
 	color1= colormap[0]
 	color2= colormap[1]
-	if make_fig:
-		html="""<div id="chart_{num}"></div>""".format(num=figure)
-		display(HTML(html))
-	begin="""require(['d3', 'crossfilter', 'dc'], function(d3, crossfilter, dc) {"""
-	end="""})"""
 	chart="""
 	d3.select("#chart_{figure}").append("p").text("heatmap: {dim1},{dim2},{dim3}");
-	var dim = cf.dimension(function(d) {
-	return [d.{dim1}, d.{dim2}];
-	});
-	var heatColorMapping = function(d){
-		return d3.scale.linear().domain([{clim1},{clim2}]).range(["{color1}","{color2}"])(d);
-	};
-	heatColorMapping.domain = function(d){
-		return [{clim1},{clim2}];
-	};
-	var gp = dim.group().reduce(
-	function(p,v){
-		++p.count;
-		p.sum+=Number(v.{dim3});
-		p.ave =p.count ? (p.sum/p.count):0;
-		return p;
-		},
-	function(p,v){
-		--p.count;
-		p.sum-=Number(v.{dim3});
-		p.ave =p.count ? (p.sum/p.count):0;
-		return p;
-		},
-	function(p){return{
-		count:0,
-		sum:0,
-		ave:0};}
-	)
+	{prepare}
+	var dim = {dim_js};
+	{colors}
+	var gp = {gp_js};
 	var chart_{figure}_obj = dc.heatMap('#chart_{figure}');
 	chart_{figure}_obj
 		.width({width})
@@ -577,23 +1981,41 @@ def heatmap(figure=1,make_fig=False,width=200,height=200,dim=['','',''],group='C
 		.group(gp)
 		.keyAccessor(function(d){return +d.key[0]})
 		.valueAccessor(function(d){return +d.key[1]})
-		.colorAccessor(function(d){return +d.value.ave})
+		.colorAccessor(function(d){return pydcjs.value(d.value)})
 		.colors(heatColorMapping)
 		.calculateColorDomain()
 		.transitionDuration({transitionDuration})
 		.label(function(d){
-			return [d.key[0],d.key[1],d.value.ave];
+			return [{key0},{key1},pydcjs.value(d.value)];
 		});
 	chart_{figure}_obj
 		//.xAxisLabel("{xlabel}")
 		//.yAxisLabel("{ylabel}")
 		.xBorderRadius(0)
 		.yBorderRadius(0)
-		.render()
+		{render}
+	{post}
 	"""
+	# the kernel-side engine already keys composite dimensions by integer code
+	pack=pack and _current['engine'] is None and not _current['worker']
+	packed={'prepare':'','key':'[d.%s, d.%s]'%(dim1,dim2),'rows':[dim1,dim2]}
+	if pack:
+		packed=_packed([dim1,dim2],resolution)
+	reduce,value=_reduce(dim3,reduce)
+	src=_source(figure,packed['key'],[dim1,dim2],_reduce_js(reduce,value),reduce,value,rows=packed['rows'])
+	if pack:
+		src=_pack_source(figure,src)
+	labels=_axis_labels(figure,src,['colsLabel','rowsLabel'])
+	if _use_canvas(canvas,[dim1,dim2]):
+		chart=_canvas_chart\
+		.replace('{title}','heatmap: {dim1},{dim2},{dim3}')\
+		.replace('{options}',"{kind: 'heatmap', colors: heatColorMapping, colorAccessor: function(d){return pydcjs.value(d.value)}, labels: [%s]}"\
+				%','.join(labels or 'null' for labels in src['labels']))
+		labels=''
 
-	display(Javascript(begin\
-	+chart\
+	_emit(figure,chart\
+	.replace('{prepare}',packed['prepare'])\
+	.replace('{colors}',_heatmap_colors)\
 	.replace('{figure}',str(figure))\
 	.replace('{width}',str(width))\
 	.replace('{height}',str(height))\
@@ -608,7 +2030,12 @@ def heatmap(figure=1,make_fig=False,width=200,height=200,dim=['','',''],group='C
 	.replace('{xlabel}',str(xlabel))\
 	.replace('{ylabel}',str(ylabel))\
 	.replace('{transitionDuration}',str(transitionDuration))\
-	+end))
+	.replace('{key0}',_key_part(src,0))\
+	.replace('{key1}',_key_part(src,1))\
+	.replace('{post}',src['post']+labels)\
+	.replace('{dim_js}',src['dim_js'])\
+	.replace('{gp_js}',src['gp_js'])\
+	,make_fig)
 
 # def table(figure=1,make_fig=True,width=200,height=200,dim=[''],group='Count'\
 # 			,transitionDuration=500):
@@ -680,7 +2107,7 @@ def add_reset():
 	html="""
 	<a href="javascript:
 	require(['d3', 'crossfilter', 'dc'], function(d3, crossfilter, dc) {
-	dc.filterAll(); dc.renderAll();
+	dc.filterAll(); pydcjs.renderAll();
 	})">Reset All</a>"""
 	display(HTML(html))
 
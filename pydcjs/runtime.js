@@ -0,0 +1,1123 @@
+// pydcjs browser runtime, injected once by load_js()
+window.pydcjs = window.pydcjs || {};
+(function(pydcjs) {
+
+	// base64 -> typed array ('Float64', 'Float32', 'Int32', ...)
+	pydcjs.decode = function(type, b64) {
+		var bin = atob(b64);
+		var n = bin.length;
+		var bytes = new Uint8Array(n);
+		for (var i = 0; i < n; i++) {
+			bytes[i] = bin.charCodeAt(i);
+		}
+		return new window[type + 'Array'](bytes.buffer);
+	};
+
+	pydcjs.decodeColumn = function(col) {
+		if (col.type === 'json') {
+			return col.data;
+		}
+		var values = pydcjs.decode(col.type, col.data);
+		if (col.unit === undefined && col.scale === undefined) {
+			return values;
+		}
+		// Int32 codes: datetimes as base + code * unit epoch ms, fixed
+		// precision numbers as code / scale; the largest code is a missing
+		// value, which sorts last as Infinity
+		var n = values.length;
+		var out = new Float64Array(n);
+		for (var i = 0; i < n; i++) {
+			var v = values[i];
+			out[i] = v === 2147483647 ? Infinity : col.scale ? v / col.scale : col.base + v * col.unit;
+		}
+		return out;
+	};
+
+	// Row views over column arrays: one small object per row, the values
+	// stay in the typed arrays and are read through prototype getters.
+	// __i numbers rows in arrival order; rows.offset is the number of rows[0].
+	pydcjs.defineColumn = function(rows, name, values) {
+		var offset = rows.offset || 0;
+		rows.columns[name] = values;
+		Object.defineProperty(rows.Row.prototype, name, {
+			get: function() { return values[this.__i - offset]; },
+			enumerable: true,
+			configurable: true
+		});
+	};
+
+	// frame: rows already on the page that this payload continues (append_df);
+	// the new rows inherit the columns added to the frame later on
+	pydcjs.fromColumns = function(payload, frame) {
+		var n = payload.n;
+		function Row(i) { this.__i = i; }
+		var rows = new Array(n);
+		rows.columns = {};
+		rows.labels = payload.labels || {};
+		rows.offset = 0;
+		if (frame) {
+			Row.prototype = Object.create(frame.Row.prototype);
+			rows.offset = frame.offset + frame.length;
+		}
+		rows.Row = Row;
+		payload.columns.forEach(function(col) {
+			pydcjs.defineColumn(rows, col.name, pydcjs.decodeColumn(col));
+		});
+		for (var i = 0; i < n; i++) {
+			rows[i] = new Row(rows.offset + i);
+		}
+		return rows;
+	};
+
+	// rows pushed by append_df: added to the crossfilter and to cfdata, the
+	// oldest rows beyond the window removed, then one redraw for the batch
+	pydcjs.append = function(cf, rows, batch, keep) {
+		var start;
+		if (rows.offset === undefined) {
+			rows.offset = 0;
+			rows.forEach(function(d, i) { d.__i = i; });
+		}
+		if (rows.Row) {
+			for (var name in batch.labels) {
+				var labels = rows.labels[name];
+				for (var j = labels.length; j < batch.labels[name].length; j++) {
+					labels.push(batch.labels[name][j]);
+				}
+			}
+			batch = pydcjs.fromColumns(batch, rows);
+		} else {
+			start = rows.offset + rows.length;
+			batch.forEach(function(d, i) { d.__i = start + i; });
+		}
+		pydcjs.uncache(cf);
+		cf.add(batch);
+		for (var i = 0; i < batch.length; i++) {
+			rows.push(batch[i]);
+		}
+		if (keep !== null && rows.length > keep) {
+			pydcjs.evict(cf, rows, rows.length - keep);
+		}
+		require('dc').redrawAll();
+	};
+
+	// crossfilter's remove() drops the rows matching every current filter, so
+	// the chart filters are lifted while the oldest rows are selected
+	pydcjs.evict = function(cf, rows, n) {
+		var dc = require('dc');
+		var order = cf.pydcjsOrder || (cf.pydcjsOrder = cf.dimension(function(d) { return d.__i; }));
+		var charts = dc.chartRegistry.list().filter(function(chart) {
+			var dimension = chart.dimension();
+			return chart.hasFilter() && dimension.pydcjs && dimension.pydcjs.cf === cf;
+		});
+		charts.forEach(function(chart) {
+			chart.dimension().filterAll();
+		});
+		order.filterRange([rows.offset, rows.offset + n]);
+		cf.remove();
+		order.filterAll();
+		charts.forEach(function(chart) {
+			chart.filterHandler()(chart.dimension(), chart.filters());
+		});
+		rows.splice(0, n);
+		rows.offset += n;
+	};
+
+	// Frames by set_df name: rows, crossfilter (or worker) and the anchors of
+	// the charts drawn from them. window.cf and window.cfdata follow the last
+	// frame set, for scripts written against them.
+	pydcjs.frames = {};
+	pydcjs.setFrame = function(name, cfdata, cf, worker) {
+		pydcjs.frames[name] = {name: name, cfdata: cfdata, cf: cf, worker: worker || null, anchors: {}};
+		window.cfdata = cfdata;
+		window.cf = cf;
+		return pydcjs.frames[name];
+	};
+	pydcjs.use = function(name, anchor) {
+		for (var other in pydcjs.frames) {
+			delete pydcjs.frames[other].anchors[anchor];
+		}
+		var frame = pydcjs.frames[name];
+		frame.anchors[anchor] = true;
+		return frame;
+	};
+	// deregister the charts of a frame, dispose their dimensions and drop the
+	// rows; keepHash leaves the crossfilter in pydcjs.cache if it is cached
+	// under that hash, so that set_df of the same frame under the same name
+	// can still restore it
+	pydcjs.dispose = function(name, keepHash) {
+		var frame = pydcjs.frames[name];
+		if (!frame) {
+			return;
+		}
+		delete pydcjs.frames[name];
+		Object.keys(frame.anchors).forEach(function(anchor) {
+			pydcjs.release(anchor);
+		});
+		if (frame.worker) {
+			frame.worker.thread.terminate();
+		}
+		delete pydcjs.loading[name];
+		var cf = frame.cf;
+		var shared = Object.keys(pydcjs.frames).some(function(other) {
+			return pydcjs.frames[other].cf === cf;
+		});
+		if (cf && !shared) {
+			if (cf.pydcjsOrder) {
+				cf.pydcjsOrder.dispose();
+				delete cf.pydcjsOrder;
+			}
+			pydcjs.uncache(cf, keepHash);
+		}
+		if (window.cfdata === frame.cfdata) {
+			window.cfdata = null;
+			window.cf = null;
+		}
+	};
+
+	// frames already built on this page, by content hash (least recently
+	// used first); set_df only sends the hash when the frame is unchanged
+	pydcjs.cache = {frames: {}, order: [], size: 4, hits: 0, misses: 0};
+	pydcjs.cacheFrame = function(hash, cfdata, cf) {
+		var cache = pydcjs.cache;
+		cache.misses++;
+		if (hash === 'None') {
+			return;
+		}
+		if (!cache.frames[hash]) {
+			cache.order.push(hash);
+		}
+		cache.frames[hash] = {cfdata: cfdata, cf: cf};
+		while (cache.order.length > cache.size) {
+			delete cache.frames[cache.order.shift()];
+		}
+	};
+	// a crossfilter that no longer matches its hash (append_df) or was disposed
+	pydcjs.uncache = function(cf, keepHash) {
+		var cache = pydcjs.cache;
+		cache.order.slice().forEach(function(hash) {
+			if (cache.frames[hash].cf === cf && hash !== keepHash) {
+				delete cache.frames[hash];
+				cache.order.splice(cache.order.indexOf(hash), 1);
+			}
+		});
+	};
+	pydcjs.restoreFrame = function(hash, name) {
+		var cache = pydcjs.cache;
+		var frame = cache.frames[hash];
+		if (!frame) {
+			return false;
+		}
+		cache.hits++;
+		cache.order.splice(cache.order.indexOf(hash), 1);
+		cache.order.push(hash);
+		pydcjs.setFrame(name, frame.cfdata, frame.cf);
+		return true;
+	};
+
+	// Dimensions shared between charts, keyed by accessor expression on each
+	// crossfilter and reference counted by the chart anchors using them. A
+	// chart re-rendered into the same anchor releases its previous dimension,
+	// which is disposed once no chart uses it anymore.
+	pydcjs.owners = {};
+	pydcjs.dimension = function(cf, anchor, key, accessor) {
+		var registry = cf.pydcjsDimensions || (cf.pydcjsDimensions = {});
+		var entry = registry[key];
+		if (!entry) {
+			entry = registry[key] = {key: key, cf: cf, groups: {}, refs: 0};
+			entry.dimension = pydcjs.time(anchor.replace('#', ''), 'dimension', function() {
+				return cf.dimension(accessor);
+			});
+			entry.dimension.pydcjs = entry;
+		}
+		entry.anchor = anchor.replace('#', '');
+		entry.refs++;
+		pydcjs.release(anchor);
+		pydcjs.owners[anchor] = entry;
+		return entry.dimension;
+	};
+	pydcjs.group = function(dimension, key, reduce) {
+		var groups = dimension.pydcjs.groups;
+		if (!groups[key]) {
+			groups[key] = pydcjs.time(dimension.pydcjs.anchor, 'group', function() {
+				var group = reduce(dimension);
+				if (pydcjs.settings.profile) {
+					// groups reduce lazily, on their first all()
+					group.all();
+				}
+				return group;
+			});
+		}
+		return groups[key];
+	};
+	pydcjs.release = function(anchor) {
+		var dc = require('dc');
+		dc.chartRegistry.list().forEach(function(chart) {
+			if (chart.anchor() === anchor) {
+				chart.filter(null);
+				dc.deregisterChart(chart);
+			}
+		});
+		delete pydcjs.series[anchor.replace('#', '')];
+		var top = pydcjs.topk[anchor.replace('#', '')];
+		if (top) {
+			delete pydcjs.topk[anchor.replace('#', '')];
+			top.levels.slice(1).forEach(function(level) {
+				level.dimension.dispose();
+			});
+		}
+		var entry = pydcjs.owners[anchor];
+		delete pydcjs.owners[anchor];
+		if (entry && --entry.refs === 0) {
+			entry.dimension.filterAll();
+			entry.dimension.dispose();
+			delete entry.cf.pydcjsDimensions[entry.key];
+		}
+	};
+
+	// Reducers by name: count, sum, mean, min, max, distinct of accessor(row).
+	// Each group value is a plain object whose value field stays current:
+	// sum and mean add and remove in O(1), min and max keep a count per
+	// distinct value and a heap of those values (entries whose count dropped
+	// to 0 are only popped once they reach the top), so both are O(log n),
+	// distinct is a count map. Missing values (null, NaN, Infinity) are
+	// skipped. Self-contained, so the worker can copy it.
+	pydcjs.reduce = function(group, name, accessor) {
+		if (name === 'count') {
+			return group.reduceCount();
+		}
+		var missing = function(x) {
+			return x === null || x === undefined || x !== x || x === Infinity || x === -Infinity;
+		};
+		var better = name === 'min' ? function(a, b) { return a < b; } : function(a, b) { return a > b; };
+		var push = function(h, x) {
+			var i = h.push(x) - 1;
+			while (i > 0) {
+				var j = (i - 1) >> 1;
+				if (!better(h[i], h[j])) {
+					break;
+				}
+				h[i] = h[j];
+				h[j] = x;
+				i = j;
+			}
+		};
+		var pop = function(h) {
+			var last = h.pop();
+			if (!h.length) {
+				return;
+			}
+			h[0] = last;
+			for (var i = 0, n = h.length; ; ) {
+				var l = 2 * i + 1, r = l + 1, top = i;
+				if (l < n && better(h[l], h[top])) {
+					top = l;
+				}
+				if (r < n && better(h[r], h[top])) {
+					top = r;
+				}
+				if (top === i) {
+					break;
+				}
+				h[i] = h[top];
+				h[top] = last;
+				i = top;
+			}
+		};
+		// drop heap entries that no row holds any more; the top is the extreme
+		var settle = function(p) {
+			var h = p.heap;
+			while (h.length && !p.counts[h[0]]) {
+				delete p.counts[h[0]];
+				pop(h);
+			}
+			p.value = h.length ? h[0] : 0;
+		};
+		var add = function(p, v) {
+			var x = accessor(v);
+			if (missing(x)) {
+				return p;
+			}
+			p.count++;
+			if (name === 'sum' || name === 'mean') {
+				p.sum += x;
+				p.value = name === 'sum' ? p.sum : p.ave = p.sum / p.count;
+			} else if (name === 'distinct') {
+				if (!p.counts[x]) {
+					p.counts[x] = 0;
+					p.value++;
+				}
+				p.counts[x]++;
+			} else {
+				if (p.counts[x] === undefined) {
+					p.counts[x] = 0;
+					push(p.heap, x);
+				}
+				p.counts[x]++;
+				settle(p);
+			}
+			return p;
+		};
+		var remove = function(p, v) {
+			var x = accessor(v);
+			if (missing(x)) {
+				return p;
+			}
+			p.count--;
+			if (name === 'sum' || name === 'mean') {
+				p.sum -= x;
+				p.value = name === 'sum' ? p.sum : p.ave = p.count ? p.sum / p.count : 0;
+			} else if (name === 'distinct') {
+				if (--p.counts[x] === 0) {
+					delete p.counts[x];
+					p.value--;
+				}
+			} else if (--p.counts[x] === 0 && x === p.value) {
+				settle(p);
+			}
+			return p;
+		};
+		return group.reduce(add, remove, function() {
+			return name === 'mean' ? {count: 0, sum: 0, ave: 0, value: 0}
+				: name === 'sum' ? {count: 0, sum: 0, value: 0}
+				: name === 'distinct' ? {count: 0, counts: {}, value: 0}
+				: {count: 0, counts: {}, heap: [], value: 0};
+		});
+	};
+	// a group value as a number: counts, reducer objects, or the {ave} of
+	// the kernel's mean groups
+	pydcjs.value = function(v) {
+		if (v === null || typeof v !== 'object') {
+			return v;
+		}
+		return v.value === undefined ? v.ave : v.value;
+	};
+
+	// boxplot reducer: a count per distinct value, so add and remove are O(1)
+	// instead of indexOf/splice on a raw array; the sorted values are only
+	// rebuilt when a box is drawn after its group changed
+	pydcjs.boxReducer = function(group, accessor) {
+		return group.reduce(
+			function(p, v) {
+				var x = accessor(v);
+				if (x === x && x !== null && x !== Infinity) {
+					p.counts[x] = (p.counts[x] || 0) + 1;
+					p.n++;
+					p.dirty = true;
+				}
+				return p;
+			},
+			function(p, v) {
+				var x = accessor(v);
+				if (x === x && x !== null && x !== Infinity) {
+					if (--p.counts[x] === 0) {
+						delete p.counts[x];
+					}
+					p.n--;
+					p.dirty = true;
+				}
+				return p;
+			},
+			function() {
+				return {counts: {}, n: 0, dirty: false, values: []};
+			}
+		);
+	};
+	pydcjs.boxValues = function(d) {
+		var p = d.value;
+		if (p.dirty) {
+			var keys = Object.keys(p.counts).map(Number).sort(function(a, b) {
+				return a - b;
+			});
+			var values = new Float64Array(p.n);
+			var k = 0;
+			keys.forEach(function(key) {
+				values.fill(key, k, k + p.counts[key]);
+				k += p.counts[key];
+			});
+			p.values = values;
+			p.dirty = false;
+		}
+		return p.values;
+	};
+
+	// Composite keys packed into one number on the Python side: tables[i]
+	// maps the i-th code back to its value (mixed radix, last column fastest).
+	pydcjs.packed = function(tables) {
+		var strides = [];
+		for (var i = tables.length - 1, s = 1; i >= 0; s *= tables[i].length, i--) {
+			strides[i] = s;
+		}
+		return {
+			unpack: function(key) {
+				return tables.map(function(table, i) {
+					return table[Math.floor(key / strides[i]) % table.length];
+				});
+			}
+		};
+	};
+	// group over a packed dimension, seen by dc.js with array keys
+	pydcjs.unpackedGroup = function(group, pk) {
+		var source = null;
+		var wrapped = [];
+		var all = function() {
+			var entries = group.all();
+			if (entries !== source || entries.length !== wrapped.length) {
+				source = entries;
+				wrapped = entries.map(function(entry) {
+					return Object.defineProperty({key: pk.unpack(entry.key)}, 'value', {
+						get: function() { return entry.value; },
+						enumerable: true
+					});
+				});
+			}
+			return wrapped;
+		};
+		return {
+			all: all,
+			top: function(k) {
+				return all().slice().sort(function(a, b) {
+					return b.value - a.value;
+				}).slice(0, k);
+			},
+			size: function() { return group.size(); }
+		};
+	};
+	// dc.js filters (2D ranges, [x, y] keys) applied to packed keys
+	pydcjs.packedFilterHandler = function(pk) {
+		return function(dimension, filters) {
+			if (filters.length === 0) {
+				dimension.filter(null);
+			} else {
+				dimension.filterFunction(function(key) {
+					var point = pk.unpack(key);
+					for (var i = 0; i < filters.length; i++) {
+						var filter = filters[i];
+						if (filter.isFiltered ? filter.isFiltered(point)
+								: point.length === filter.length && point.every(function(x, j) { return x === filter[j]; })) {
+							return true;
+						}
+					}
+					return false;
+				});
+			}
+			return filters;
+		};
+	};
+
+	// Scatter plots and heatmaps with more points than SVG can handle: a dc.js
+	// chart (same dimension, group, filters and redraw cycle as dc.scatterPlot
+	// and dc.heatMap) that paints its groups on one <canvas> without
+	// transitions; SVG is only used for the axes and the brush.
+	pydcjs.canvasChart = function(anchor, options) {
+		var dc = require('dc');
+		var d3 = require('d3');
+		var chart = dc.marginMixin(dc.baseMixin({}));
+		var context, x, y, cols, rows, brush, brushLayer;
+		chart.margins({top: 10, right: 10, bottom: 30, left: 40});
+		chart.transitionDuration(0);
+
+		var paint = function() {
+			var data = chart.data();
+			context.clearRect(0, 0, x.range()[1], y.range()[0]);
+			if (options.kind === 'scatter') {
+				var r = options.symbolSize / 2;
+				context.fillStyle = options.color;
+				context.beginPath();
+				data.forEach(function(d) {
+					if (d.value > 0) {
+						var px = x(d.key[0]), py = y(d.key[1]);
+						context.moveTo(px + r, py);
+						context.arc(px, py, r, 0, 2 * Math.PI);
+					}
+				});
+				context.fill();
+			} else {
+				var w = Math.ceil(x.rangeBand()), h = Math.ceil(y.rangeBand());
+				var filtered = chart.hasFilter();
+				data.forEach(function(d) {
+					context.fillStyle = filtered && !chart.hasFilter(d.key) ? '#ccc'
+						: options.colors(options.colorAccessor(d));
+					context.fillRect(x(d.key[0]), y(d.key[1]), w, h);
+				});
+			}
+		};
+
+		chart._doRender = function() {
+			var m = chart.margins();
+			var width = chart.width() - m.left - m.right;
+			var height = chart.height() - m.top - m.bottom;
+			chart.root().select('div.pydcjs-canvas').remove();
+			var layer = chart.root().append('div')
+				.attr('class', 'pydcjs-canvas')
+				.style({position: 'relative', width: chart.width() + 'px', height: chart.height() + 'px'});
+			var canvas = layer.append('canvas')
+				.attr({width: width, height: height})
+				.style({position: 'absolute', left: m.left + 'px', top: m.top + 'px'});
+			context = canvas.node().getContext('2d');
+			var g = layer.append('svg')
+				.attr({width: chart.width(), height: chart.height()})
+				.style({position: 'absolute', left: 0, top: 0, 'pointer-events': 'none'})
+				.append('g')
+				.attr('transform', 'translate(' + m.left + ',' + m.top + ')');
+			var xAxis = d3.svg.axis().orient('bottom');
+			var yAxis = d3.svg.axis().orient('left');
+			if (options.kind === 'scatter') {
+				x = d3.scale[options.xscale]().domain(options.x).range([0, width]);
+				y = d3.scale[options.yscale]().domain(options.y).range([height, 0]);
+				xAxis.ticks(5);
+				yAxis.ticks(5);
+				brush = d3.svg.brush().x(x).y(y).on('brush', function() {
+					var filter = brush.empty() ? null : dc.filters.RangedTwoDimensionalFilter(brush.extent());
+					dc.events.trigger(function() {
+						chart.replaceFilter(filter);
+						chart.redrawGroup();
+					}, dc.constants.EVENT_DELAY);
+				});
+				brushLayer = g.append('g')
+					.attr('class', 'brush')
+					.style('pointer-events', 'all')
+					.call(brush);
+			} else {
+				var keys = function(i) {
+					var values = chart.data().map(function(d) { return d.key[i]; }).sort(d3.ascending);
+					return values.filter(function(v, j) { return j === 0 || v !== values[j - 1]; });
+				};
+				var every = function(values) {
+					var step = Math.ceil(values.length / 10);
+					return values.filter(function(v, i) { return i % step === 0; });
+				};
+				cols = keys(0);
+				rows = keys(1);
+				x = d3.scale.ordinal().domain(cols).rangeBands([0, width]);
+				y = d3.scale.ordinal().domain(rows).rangeBands([height, 0]);
+				xAxis.tickValues(every(cols));
+				yAxis.tickValues(every(rows));
+				canvas.on('click', function() {
+					var p = d3.mouse(this);
+					var key = [cols[Math.floor(p[0] / x.rangeBand())],
+						rows[rows.length - 1 - Math.floor(p[1] / y.rangeBand())]];
+					if (key[0] !== undefined && key[1] !== undefined) {
+						dc.events.trigger(function() {
+							chart.filter(dc.filters.TwoDimensionalFilter(key));
+							chart.redrawGroup();
+						});
+					}
+				});
+			}
+			// label tables of dictionary-encoded key columns, by axis
+			(options.labels || []).forEach(function(labels, i) {
+				if (labels) {
+					(i ? yAxis : xAxis).tickFormat(function(k) { return pydcjs.keyLabel(labels, k); });
+				}
+			});
+			g.append('g').attr('class', 'axis x')
+				.attr('transform', 'translate(0,' + height + ')')
+				.call(xAxis.scale(x));
+			g.append('g').attr('class', 'axis y').call(yAxis.scale(y));
+			paint();
+			return chart;
+		};
+
+		chart._doRedraw = function() {
+			if (brush && !chart.hasFilter()) {
+				brushLayer.call(brush.clear());
+			}
+			paint();
+			return chart;
+		};
+
+		return chart.anchor(anchor);
+	};
+
+	// dictionary-encoded columns: map codes back to their labels
+	// records parsed from JSON: {rows, missing} when numeric columns have
+	// missing values, which JSON sends as null and the page keeps as Infinity
+	pydcjs.records = function(payload) {
+		if (!payload.missing) {
+			return payload;
+		}
+		var rows = payload.rows;
+		payload.missing.forEach(function(name) {
+			for (var i = 0; i < rows.length; i++) {
+				if (rows[i][name] === null) {
+					rows[i][name] = Infinity;
+				}
+			}
+		});
+		return rows;
+	};
+
+	pydcjs.keyLabel = function(labels, key) {
+		return labels[key] === undefined ? key : labels[key];
+	};
+
+	pydcjs.labelLegend = function(chart, labels) {
+		var relabel = function() {
+			chart.selectAll('g.dc-legend-item text').text(function(d) {
+				return pydcjs.keyLabel(labels, d.name);
+			});
+		};
+		relabel();
+		chart.on('renderlet.labels', relabel);
+	};
+
+	// base64 of gzip-compressed text (export_html) -> Promise of the text
+	pydcjs.gunzip = function(b64) {
+		var stream = new Blob([pydcjs.decode('Uint8', b64)]).stream()
+			.pipeThrough(new DecompressionStream('gzip'));
+		return new Response(stream).text();
+	};
+
+	// attach a column computed on the Python side (e.g. bin indices)
+	pydcjs.addColumn = function(rows, name, col) {
+		var values = pydcjs.decodeColumn(col);
+		if (rows.Row) {
+			pydcjs.defineColumn(rows, name, values);
+		} else {
+			for (var i = 0; i < rows.length; i++) {
+				rows[i][name] = values[i];
+			}
+		}
+	};
+
+	// performance mode (config['performance'] in Python): no transitions,
+	// brush redraws debounced by brushDelay ms, and charts added to the page
+	// redraw the others instead of re-rendering them
+	pydcjs.settings = {performance: false, brushDelay: 100, profile: false};
+	pydcjs.configure = function(settings) {
+		var dc = require('dc');
+		if (pydcjs.eventDelay === undefined) {
+			pydcjs.eventDelay = dc.constants.EVENT_DELAY;
+		}
+		if (settings.profile && !pydcjs.spans.instrumented) {
+			pydcjs.spans.instrumented = true;
+			pydcjs.instrument(dc);
+		}
+		pydcjs.settings = settings;
+		dc.disableTransitions = settings.performance;
+		dc.constants.EVENT_DELAY = settings.performance ? settings.brushDelay : pydcjs.eventDelay;
+	};
+	pydcjs.renderAll = function() {
+		var dc = require('dc');
+		if (pydcjs.settings.performance) {
+			dc.redrawAll();
+		} else {
+			dc.renderAll();
+		}
+	};
+
+	// profiling (config['profile'] in Python): performance.now() spans of
+	// the set_df and chart stages, numbered by the filter event they follow,
+	// sent to the kernel in batches and read there with profile()
+	pydcjs.spans = {event: 0, queue: [], timer: null, instrumented: false};
+	pydcjs.time = function(chart, stage, fn) {
+		if (!pydcjs.settings.profile) {
+			return fn();
+		}
+		var start = performance.now();
+		var result = fn();
+		pydcjs.span(chart, stage, start, performance.now());
+		return result;
+	};
+	pydcjs.span = function(chart, stage, start, end) {
+		var spans = pydcjs.spans;
+		spans.queue.push({event: spans.event, chart: chart, stage: stage, start: start, ms: end - start});
+		if (!spans.timer) {
+			spans.timer = setTimeout(function() {
+				spans.timer = null;
+				pydcjs.send('profile', {spans: spans.queue.splice(0)});
+			}, 500);
+		}
+	};
+	// charts created once profiling is on time their renders and redraws (up
+	// to the start of the transitions) and their filters
+	pydcjs.instrument = function(dc) {
+		var baseMixin = dc.baseMixin;
+		dc.baseMixin = function(chart) {
+			chart = baseMixin(chart);
+			var start = null, stage;
+			var begin = function(name) {
+				return function() {
+					start = performance.now();
+					stage = name;
+				};
+			};
+			chart.on('preRender.pydcjs', begin('render'))
+				.on('preRedraw.pydcjs', begin('redraw'))
+				.on('pretransition.pydcjs', function() {
+					if (start !== null && pydcjs.settings.profile) {
+						pydcjs.span(chart.anchorName(), stage, start, performance.now());
+					}
+					start = null;
+				});
+			var filter = chart.filter;
+			chart.filter = function(f) {
+				if (!arguments.length || !pydcjs.settings.profile) {
+					return filter.apply(chart, arguments);
+				}
+				pydcjs.spans.event++;
+				return pydcjs.time(chart.anchorName(), 'filter', function() {
+					return filter.call(chart, f);
+				});
+			};
+			return chart;
+		};
+	};
+
+	// one kernel comm shared by everything that talks back to Python;
+	// incoming messages are dispatched on their 'type'
+	pydcjs.handlers = {};
+	pydcjs.send = function(type, data) {
+		if (!window.Jupyter || !Jupyter.notebook.kernel) {
+			return;
+		}
+		if (!pydcjs.comm) {
+			pydcjs.comm = Jupyter.notebook.kernel.comm_manager.new_comm('pydcjs', {});
+			pydcjs.comm.on_msg(function(msg) {
+				var data = msg.content.data;
+				var handler = pydcjs.handlers[data.type];
+				if (handler) {
+					handler(data);
+				}
+			});
+		}
+		data.type = type;
+		pydcjs.comm.send(data);
+	};
+
+	// dimensions and groups held by the kernel (set_df(engine='python')):
+	// filters go to Python, aggregated groups come back
+	pydcjs.remote = {groups: {}};
+	pydcjs.remoteDimension = function(id) {
+		return {
+			id: id,
+			filter: function() { return this; },
+			filterAll: function() { return this; }
+		};
+	};
+	pydcjs.remoteGroup = function(id, data) {
+		var group = {
+			data: data,
+			all: function() { return group.data; },
+			top: function(k) {
+				return group.data.slice().sort(function(a, b) {
+					return b.value - a.value;
+				}).slice(0, k);
+			},
+			size: function() { return group.data.length; }
+		};
+		pydcjs.remote.groups[id] = group;
+		return group;
+	};
+	// time-series lineCharts (lineChart(points=...)): the kernel resamples the
+	// rows selected by the other charts and answers each filter sync of the
+	// frame with new lines, finer inside the range brushed on the chart
+	pydcjs.series = {};
+	pydcjs.seriesGroup = function(anchor, data) {
+		var group = pydcjs.remoteGroup(anchor, data);
+		delete pydcjs.remote.groups[anchor];
+		pydcjs.series[anchor] = group;
+		return group;
+	};
+	pydcjs.handlers.series = function(data) {
+		var dc = require('dc');
+		dc.chartRegistry.list().forEach(function(chart) {
+			var anchor = chart.anchorName();
+			if (pydcjs.series[anchor] && data.charts[anchor]) {
+				pydcjs.series[anchor].data = data.charts[anchor];
+				chart.redraw();
+			}
+		});
+	};
+	// Top-K pie and row charts (top=K): keys beyond the first K share one
+	// Others code. Clicking Others asks the kernel to split the rows in it
+	// into the next K keys, and only their codes come back; the last code of
+	// a drilled level leads back to the level above, which stays on the page.
+	pydcjs.topk = {};
+	// reduce(dimension): the chart's group on the dimension of a new level
+	pydcjs.topK = function(chart, frame, anchor, labels, name, others, reduce) {
+		var state = pydcjs.topk[anchor] = {chart: chart, frame: frame, labels: labels, reduce: reduce, levels: [{
+			name: name, labels: labels.slice(), others: others,
+			dimension: chart.dimension(), group: chart.group()
+		}]};
+		var click = chart.onClick;
+		chart.onClick = function(d) {
+			var key = chart.keyAccessor()(d);
+			var depth = state.levels.length - 1;
+			var level = state.levels[depth];
+			if (key === level.others) {
+				pydcjs.send('drill', {frame: frame.name, anchor: anchor, level: depth + 1});
+			} else if (depth > 0 && key === level.others + 1) {
+				pydcjs.send('drill', {frame: frame.name, anchor: anchor, level: depth - 1});
+				var dimension = state.levels.pop().dimension;
+				pydcjs.topLevel(state);
+				dimension.dispose();
+			} else {
+				click.call(chart, d);
+			}
+		};
+	};
+	// show the deepest level: its dimension, group and labels, no filter
+	pydcjs.topLevel = function(state) {
+		var level = state.levels[state.levels.length - 1];
+		state.chart.filter(null);
+		state.labels.length = 0;
+		Array.prototype.push.apply(state.labels, level.labels);
+		state.chart.dimension(level.dimension).group(level.group);
+		require('dc').redrawAll();
+	};
+	pydcjs.handlers.drill = function(data) {
+		var state = pydcjs.topk[data.anchor];
+		if (!state || state.levels.length !== data.level) {
+			return;
+		}
+		var rows = state.frame.cfdata;
+		var above = state.levels[data.level - 1];
+		var subset = pydcjs.decodeColumn(data.codes);
+		var values = new subset.constructor(rows.length);
+		for (var i = 0, j = 0; i < rows.length; i++) {
+			values[i] = rows[i][above.name] === above.others ? subset[j++] : data.others + 1;
+		}
+		if (rows.Row) {
+			pydcjs.defineColumn(rows, data.name, values);
+		} else {
+			for (i = 0; i < rows.length; i++) {
+				rows[i][data.name] = values[i];
+			}
+		}
+		var dimension = state.frame.cf.dimension(function(d) { return d[data.name]; });
+		state.levels.push({name: data.name, labels: data.labels, others: data.others,
+			dimension: dimension, group: state.reduce(dimension)});
+		pydcjs.topLevel(state);
+	};
+	// dc.js filters as plain data; a RangedFilter becomes {range: [lo, hi]}
+	// and a RangedTwoDimensionalFilter {range2d: [[x0, y0], [x1, y1]]}.
+	// Dates from time axes go as epoch ms, the keys the kernel compares them to
+	pydcjs.plainFilters = function(filters) {
+		return filters.map(function(f) {
+			if (f instanceof Date) {
+				return +f;
+			}
+			if (f.filterType === 'RangedFilter') {
+				return {range: [+f[0], +f[1]]};
+			}
+			if (f.filterType === 'RangedTwoDimensionalFilter') {
+				return {range2d: [[Math.min(f[0][0], f[1][0]), Math.min(f[0][1], f[1][1])],
+					[Math.max(f[0][0], f[1][0]), Math.max(f[0][1], f[1][1])]]};
+			}
+			return f;
+		});
+	};
+	// the filters of every chart go back to the kernel (get_filtered), at most
+	// once per brushDelay ms and per frame
+	pydcjs.sync = {frames: {}, timer: null};
+	pydcjs.syncFilters = function(chart, frame) {
+		chart.on('filtered.pydcjs', function() {
+			var sync = pydcjs.sync;
+			var charts = sync.frames[frame.name] || (sync.frames[frame.name] = {});
+			charts[chart.anchorName()] = pydcjs.plainFilters(chart.filters());
+			if (!sync.timer) {
+				sync.timer = setTimeout(function() {
+					var frames = sync.frames;
+					sync.frames = {};
+					sync.timer = null;
+					for (var name in frames) {
+						pydcjs.send('filters', {frame: name, charts: frames[name]});
+					}
+				}, pydcjs.settings.brushDelay);
+			}
+		});
+	};
+	pydcjs.remoteFilterHandler = function(dimension, filters) {
+		pydcjs.send('filter', {
+			dim: dimension.id,
+			filters: pydcjs.plainFilters(filters)
+		});
+		return filters;
+	};
+	pydcjs.handlers.frame = function(data) {
+		var payload = JSON.parse(data.data);
+		var rows = data.columnar ? pydcjs.fromColumns(payload) : pydcjs.records(payload);
+		require(['crossfilter', 'dc'], function(crossfilter, dc) {
+			var frame = pydcjs.setFrame(data.name, rows, crossfilter(rows));
+			pydcjs.cacheFrame(data.hash, frame.cfdata, frame.cf);
+			dc.renderAll();
+		});
+	};
+
+	// set_df(engine='worker'): the rows, dimensions and groups live in a Web
+	// Worker; charts post their filters and redraw from the group results.
+	// While a filter is being computed only the latest filter of each
+	// dimension is kept, older ones are dropped.
+	pydcjs.workerMain = function(self, pydcjs, crossfilter) {
+		var cf, rows, dimensions = {}, groups = {}, bins = {};
+		var matches = function(filters) {
+			return function(key) {
+				return filters.some(function(f) {
+					return f.range ? f.range[0] <= key && key < f.range[1] : f <= key && f >= key;
+				});
+			};
+		};
+		var apply = function(dimension, filters) {
+			if (filters.length === 0) {
+				dimension.filterAll();
+			} else if (filters.length === 1 && filters[0].range) {
+				dimension.filterRange(filters[0].range);
+			} else {
+				dimension.filterFunction(matches(filters));
+			}
+		};
+		self.onmessage = function(e) {
+			var msg = e.data;
+			var out = {};
+			if (msg.type === 'data') {
+				rows = msg.columnar ? pydcjs.fromColumns(msg.payload) : msg.payload;
+				cf = crossfilter(rows);
+				return;
+			}
+			if (msg.type === 'column') {
+				pydcjs.addColumn(rows, msg.name, msg.col);
+				bins[msg.name] = msg.keys;
+				return;
+			}
+			if (msg.type === 'dimension') {
+				if (!dimensions[msg.id]) {
+					dimensions[msg.id] = cf.dimension(new Function('bins', 'return function(d) { return ' + msg.id + '; };')(bins));
+				}
+				return;
+			}
+			if (msg.type === 'group') {
+				if (!groups[msg.id]) {
+					groups[msg.id] = new Function('dim', 'pydcjs', 'return ' + msg.reduce + ';')(dimensions[msg.dim], pydcjs);
+				}
+			} else if (msg.type === 'filter') {
+				for (var dim in msg.filters) {
+					apply(dimensions[dim], msg.filters[dim]);
+				}
+			}
+			for (var id in groups) {
+				out[id] = groups[id].all();
+			}
+			self.postMessage({groups: out, filter: msg.type === 'filter'});
+		};
+	};
+	// cfdata: {labels: ...} of the dictionary-encoded columns, the page keeps no rows
+	pydcjs.startWorker = function(name, payload, columnar, cfdata) {
+		// crossfilter from the packaged sources (load_js(online=False)) or its url
+		var assets = window.pydcjsAssets;
+		var library = assets ? 'new Function("define", "module", "exports", ' + JSON.stringify(assets.crossfilter) + ').call(self);\n'
+			: 'importScripts(' + JSON.stringify(new URL(require.toUrl('crossfilter.js'), document.baseURI).href) + ');\n';
+		var source = 'var window = self;\nvar pydcjs = {};\n' +
+			['decode', 'decodeColumn', 'defineColumn', 'fromColumns', 'addColumn', 'boxReducer', 'reduce'].map(function(name) {
+				return 'pydcjs.' + name + ' = ' + pydcjs[name].toString() + ';\n';
+			}).join('') +
+			library +
+			'(' + pydcjs.workerMain.toString() + ')(self, pydcjs, crossfilter);\n';
+		var worker = {
+			thread: new Worker(URL.createObjectURL(new Blob([source], {type: 'application/javascript'}))),
+			groups: {},
+			busy: false,
+			pending: null
+		};
+		worker.thread.onmessage = function(e) {
+			for (var id in e.data.groups) {
+				if (worker.groups[id]) {
+					worker.groups[id].data = e.data.groups[id];
+				}
+			}
+			if (e.data.filter) {
+				worker.busy = false;
+				if (worker.pending) {
+					// these results are already stale, compute the latest filters
+					pydcjs.workerFilter(worker, worker.pending);
+					return;
+				}
+			}
+			require('dc').redrawAll();
+		};
+		worker.thread.postMessage({type: 'data', payload: payload, columnar: columnar});
+		pydcjs.setFrame(name, cfdata, null, worker);
+	};
+	pydcjs.workerFilter = function(worker, filters) {
+		if (worker.busy) {
+			worker.pending = worker.pending || {};
+			for (var dim in filters) {
+				worker.pending[dim] = filters[dim];
+			}
+			return;
+		}
+		worker.busy = true;
+		worker.pending = null;
+		worker.thread.postMessage({type: 'filter', filters: filters});
+	};
+	pydcjs.workerColumn = function(worker, name, col, keys) {
+		worker.thread.postMessage({type: 'column', name: name, col: col, keys: keys});
+	};
+	pydcjs.workerDimension = function(worker, anchor, key) {
+		pydcjs.release(anchor);
+		worker.thread.postMessage({type: 'dimension', id: key});
+		var dimension = pydcjs.remoteDimension(key);
+		dimension.worker = worker;
+		return dimension;
+	};
+	pydcjs.workerGroup = function(dimension, reduce) {
+		var id = dimension.id + '\n' + reduce;
+		var worker = dimension.worker;
+		if (!worker.groups[id]) {
+			worker.groups[id] = pydcjs.remoteGroup(id, []);
+			worker.thread.postMessage({type: 'group', id: id, dim: dimension.id, reduce: reduce});
+		}
+		return worker.groups[id];
+	};
+	pydcjs.workerFilterHandler = function(dimension, filters) {
+		var update = {};
+		update[dimension.id] = pydcjs.plainFilters(filters);
+		pydcjs.workerFilter(dimension.worker, update);
+		return filters;
+	};
+
+	// set_df(chunksize=n): charts render from the first chunk while the page
+	// asks the kernel for the next chunks one at a time and adds them to cf;
+	// one load per frame name, so frames set in the same cell load side by side
+	pydcjs.loading = {};
+	pydcjs.load = function(id, name, chunks, rows, hash) {
+		var frame = pydcjs.frames[name];
+		pydcjs.loading[name] = {id: id, name: name, chunks: chunks, rows: rows, hash: hash, cf: frame.cf,
+			cfdata: frame.cfdata, element: document.getElementById('pydcjs-load-' + id)};
+		pydcjs.send('chunk', {name: name, id: id, index: 1});
+	};
+	pydcjs.handlers.chunk = function(data) {
+		var load = pydcjs.loading[data.name];
+		if (!load || load.id !== data.id) {
+			return;
+		}
+		var start = performance.now();
+		pydcjs.append(load.cf, load.cfdata, pydcjs.records(JSON.parse(data.data)), null);
+		var ms = performance.now() - start;
+		var text = 'chunk ' + (data.index + 1) + '/' + load.chunks + ': ' + load.cfdata.length + ' of ' +
+			load.rows + ' rows (' + ms.toFixed(1) + ' ms)';
+		console.log('pydcjs ' + load.name + ' ' + text);
+		if (load.element) {
+			load.element.querySelector('progress').value = load.cfdata.length;
+			load.element.querySelector('span').textContent = text;
+		}
+		// the last request only reports the timing of the last chunk
+		pydcjs.send('chunk', {name: load.name, id: load.id, index: data.index + 1, ms: ms});
+		if (data.index + 1 === load.chunks) {
+			delete pydcjs.loading[load.name];
+			pydcjs.cacheFrame(load.hash, load.cfdata, load.cf);
+		}
+	};
+
+	pydcjs.handlers.groups = function(data) {
+		for (var id in data.groups) {
+			if (pydcjs.remote.groups[id]) {
+				pydcjs.remote.groups[id].data = data.groups[id];
+			}
+		}
+		require(['dc'], function(dc) {
+			dc.redrawAll();
+		});
+	};
+
+})(window.pydcjs);
@@ -11,5 +11,6 @@ setup(
         author              = __author__,
         url                 = 'https://github.com/shinesuko/pydcjs',
         packages            = ['pydcjs'],
+        package_data        = {'pydcjs': ['*.js', 'src/*.js', 'src/*.css']},
         install_requires    = []
         )
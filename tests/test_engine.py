@@ -0,0 +1,114 @@
+#coding: utf-8
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from pydcjs.engine import Crossfilter
+
+@pytest.fixture
+def df():
+	rng=np.random.RandomState(0)
+	n=500
+	v=rng.normal(size=n)
+	v[rng.rand(n)<0.05]=np.nan
+	return pd.DataFrame({'k':rng.choice(list('abcd'),n),'i':rng.randint(0,50,n),'v':v\
+		,'w':rng.randint(0,7,n),'t':pd.Timestamp('2020-01-01')+pd.to_timedelta(rng.randint(0,30,n),unit='D')})
+
+def _values(group):
+	return dict((g['key'],g['value']) for g in group.all())
+
+def _expected(df,reduce):
+	grouped=df.groupby('k')
+	if reduce=='count':
+		return grouped.size()
+	if reduce=='sum':
+		return grouped['v'].sum()
+	if reduce=='mean':
+		return grouped['v'].mean()
+	if reduce=='distinct':
+		return grouped['w'].nunique()
+	return getattr(grouped['v'],reduce)()
+
+@pytest.mark.parametrize('reduce',['count','sum','mean','min','max','distinct'])
+def test_groups_follow_other_filters(df,reduce):
+	cf=Crossfilter(df)
+	by_k=cf.dimension('k')
+	by_i=cf.dimension('i')
+	group=by_k.group(reduce,'w' if reduce=='distinct' else None if reduce=='count' else 'v')
+	for lo,hi in [(0,50),(10,20),(25,26),(0,5),(0,50)]:
+		by_i.filter_range(lo,hi)
+		expected=_expected(df[(df.i>=lo)&(df.i<hi)],reduce)
+		values=_values(group)
+		for key,value in expected.items():
+			if reduce=='mean':
+				value,got=(0 if np.isnan(value) else value),values[key]['ave']
+			else:
+				got=values[key]
+			# no rows with a value left: the engine sends null
+			got=np.nan if got is None else got
+			assert got==pytest.approx(value,nan_ok=True)
+
+def test_own_filter_is_ignored(df):
+	cf=Crossfilter(df)
+	by_k=cf.dimension('k')
+	group=by_k.group()
+	by_k.filter_in(['a'])
+	assert _values(group)==df.k.value_counts().to_dict()
+	assert cf.selected().sum()==(df.k=='a').sum()
+
+def test_filters_like_the_page(df):
+	cf=Crossfilter(df)
+	by_i=cf.dimension('i')
+	by_i.filter([{'range':[5,15]},30])
+	mask=((df.i>=5)&(df.i<15))|(df.i==30)
+	assert (cf.selected()==mask.values).all()
+	by_i.filter([])
+	assert cf.selected().all()
+
+def test_datetime_ranges_in_epoch_ms(df):
+	cf=Crossfilter(df)
+	by_t=cf.dimension('t')
+	lo,hi=pd.Timestamp('2020-01-05'),pd.Timestamp('2020-01-09')
+	by_t.filter([{'range':[lo.value//10**6,hi.value//10**6]}])
+	assert (cf.selected()==((df.t>=lo)&(df.t<hi)).values).all()
+
+def test_composite_keys(df):
+	cf=Crossfilter(df)
+	by_ki=cf.dimension(['k','w'])
+	counts=dict((tuple(g['key']),g['value']) for g in by_ki.group().all())
+	assert counts==df.groupby(['k','w']).size().to_dict()
+	by_ki.filter([['b',3]])
+	assert (cf.selected()==((df.k=='b')&(df.w==3)).values).all()
+
+def test_dispose_releases_filter_bit_and_groups(df):
+	cf=Crossfilter(df)
+	by_k=cf.dimension('k')
+	group=by_k.group()
+	by_i=cf.dimension('i')
+	by_i.filter_range(0,20)
+	by_i.dispose()
+	assert cf.selected().all()
+	assert _values(group)==df.k.value_counts().to_dict()
+	assert list(cf.dimensions)==[by_k.id]
+	by_k.dispose()
+	assert not cf.groups and not cf.dimensions and cf._bits==0
+	# bits come back: far more dimensions than 64 over time
+	for _ in range(100):
+		cf.dimension('i').dispose()
+	assert cf.dimension('i').id not in ('d0','d1')
+
+def test_missing_text_keys():
+	df=pd.DataFrame({'k':['a',None,'b','a',None],'w':[1,2,2,1,1],'v':[1.,2.,3.,4.,5.]})
+	cf=Crossfilter(df)
+	by_k=cf.dimension('k')
+	assert _values(by_k.group('sum','v'))=={'a':5.,'b':3.,None:7.}
+	by_kw=cf.dimension(['k','w'])
+	counts=dict((tuple(g['key']),g['value']) for g in by_kw.group().all())
+	assert counts=={('a',1):2,('b',2):1,(None,1):1,(None,2):1}
+	by_k.filter([None])
+	assert (cf.selected()==df.k.isna().values).all()
+	by_kw.filter([['a',1]])
+	assert not cf.selected().any()
+	by_k.filter(['a'])
+	assert (cf.selected()==(df.k=='a').values).all()
@@ -0,0 +1,59 @@
+#coding: utf-8
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from pydcjs.main import _resample, _lttb
+
+def _epoch_ms(times):
+	return pd.to_datetime(times).values.astype('datetime64[ms]').astype('int64').astype('float64')
+
+@pytest.mark.parametrize('time',[False,True])
+def test_resample_counts_every_row_in_points_buckets(time):
+	rng=np.random.RandomState(0)
+	if time:
+		x=np.sort(_epoch_ms(pd.Timestamp('2020-01-01')+pd.to_timedelta(rng.randint(0,10**6,1000),unit='s')))
+	else:
+		x=np.sort(rng.uniform(0,1,1000))
+	keys,values=_resample(x,np.ones(len(x)),'count',x.min(),x.max(),50,time)
+	assert len(keys)==50
+	assert values.sum()==len(x)
+	assert keys[0]==x.min() and keys[-1]<x.max()
+	# the last bucket is as wide as the others, not the rows at the maximum alone
+	assert values[-1]>1
+
+def test_resample_datetime_buckets_like_numbers():
+	x=_epoch_ms(pd.date_range('2020-01-01',periods=11,freq='D'))
+	y=np.arange(11.)
+	day=24*3600*1000.
+	keys,values=_resample(x,y,'sum',x[0],x[-1],5,True)
+	assert list(keys)==list(x[0]+np.arange(5)*2*day)
+	assert list(values)==[1.,5.,9.,13.,17.+10.]
+	assert list(values)==list(_resample(np.arange(11.),y,'sum',0.,10.,5,False)[1])
+
+def test_resample_skips_empty_buckets_without_a_value():
+	x=np.array([0.,1.,9.,10.])
+	keys,values=_resample(x,np.array([1.,3.,5.,7.]),'mean',0.,10.,5,False)
+	assert list(keys)==[0.,8.]
+	assert list(values)==[2.,6.]
+	assert len(_resample(x,np.ones(4),'count',0.,10.,5,False)[0])==5
+
+@pytest.mark.parametrize('n',[3,10,99])
+def test_lttb_keeps_the_ends_within_n_points(n):
+	rng=np.random.RandomState(1)
+	x=np.arange(1000.)
+	y=np.cumsum(rng.normal(size=1000))
+	kx,ky=_lttb(x,y,n)
+	assert len(kx)==n
+	assert (kx[0],ky[0])==(x[0],y[0]) and (kx[-1],ky[-1])==(x[-1],y[-1])
+	assert (np.diff(kx)>0).all()
+	assert set(kx)<=set(x)
+
+def test_lttb_keeps_spikes_and_short_series():
+	x=np.arange(100.)
+	y=np.zeros(100)
+	y[37]=10.
+	assert 37 in _lttb(x,y,10)[0]
+	kx,ky=_lttb(x[:5],y[:5],10)
+	assert list(kx)==list(x[:5])